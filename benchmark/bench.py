@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+'''Headless benchmark of xpywm.
+
+Start Xvfb, create N synthetic client windows, start WindowManager
+against the server and measure the time of typical operations.  Each
+client count runs in a separate process (and a separate Xvfb), so that
+module-level caches do not leak between runs.
+
+    python3 -m xpywm.benchmark.bench -n 10 100 500 -o result.json
+    python3 -m xpywm.benchmark.bench -b baseline.json
+
+'''
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+import types
+
+DEFAULT_CLIENTS = [10, 100, 500]
+DEFAULT_REPEAT = 20
+SCREEN = '1920x1080x24'
+CLIENT_WIDTH, CLIENT_HEIGHT = 320, 240
+
+
+# ------------------------ Xvfb
+def start_xvfb(display_number):
+    xvfb = shutil.which('Xvfb')
+    if xvfb is None:
+        sys.exit('Xvfb is not found')
+    proc = subprocess.Popen([xvfb, f':{display_number}', '-screen', '0', SCREEN,
+                             '+extension', 'RANDR', '-nolisten', 'tcp'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    socket = f'/tmp/.X11-unix/X{display_number}'
+    deadline = time.time() + 10
+    while not os.path.exists(socket):
+        if proc.poll() is not None or time.time() > deadline:
+            sys.exit(f'unable to start Xvfb :{display_number}')
+        time.sleep(.05)
+    return proc
+
+
+# ------------------------ synthetic clients
+class Clients():
+    '''Synthetic clients sharing a single connection to the X server.'''
+
+    def __init__(self, display_name):
+        from Xlib import display
+        self.display = display.Display(display_name)
+        self.screen = self.display.screen()
+        self.windows = []
+
+    def create(self, n, map_=True):
+        from Xlib import X
+        windows = []
+        for i in range(n):
+            window = self.screen.root.create_window(
+                (i * 16) % 1200, (i * 16) % 600, CLIENT_WIDTH, CLIENT_HEIGHT, 0,
+                self.screen.root_depth, X.InputOutput,
+                background_pixel=self.screen.white_pixel)
+            window.set_wm_class(f'bench{i}', 'XpywmBench')
+            window.set_wm_name(f'bench client {i}')
+            if map_:
+                window.map()
+            windows.append(window)
+        self.display.sync()
+        self.windows.extend(windows)
+        return windows
+
+    def focus(self):
+        return self.display.get_input_focus().focus
+
+
+# ------------------------ measurements
+def timeit(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def run_one(nclients, display_number, repeat):
+    '''Measure a single client count and return the result dict.'''
+    xvfb = start_xvfb(display_number)
+    try:
+        display_name = f':{display_number}'
+        os.environ['DISPLAY'] = display_name
+        return _measure(nclients, display_name, repeat)
+    finally:
+        xvfb.terminate()
+        xvfb.wait()
+
+
+def _measure(nclients, display_name, repeat):
+    import xpywm
+
+    result = {}
+    clients = Clients(display_name)
+    clients.create(nclients)
+
+    # startup adoption of existing windows
+    start = time.perf_counter()
+    wm = xpywm.WindowManager()
+    wm.display.sync()
+    result['startup_adoption'] = time.perf_counter() - start
+
+    handler = wm.event_handler
+    manager = wm.vscreen_manager
+
+    def pump():
+        wm.display.sync()
+        handler.dispatch_pending_events()
+        wm.display.sync()
+
+    pump()
+
+    # map-to-focus latency
+    latencies = []
+    for window in clients.create(repeat, map_=False):
+        start = time.perf_counter()
+        window.map()
+        clients.display.flush()
+        deadline = start + 5
+        while time.perf_counter() < deadline:
+            pump()
+            if clients.focus().id == window.id:
+                break
+        latencies.append(time.perf_counter() - start)
+    result['map_to_focus'] = statistics.median(latencies)
+
+    def vscreen():
+        return manager.current_vscreen
+
+    def sync_after(func):
+        def wrapper():
+            func()
+            wm.display.sync()
+        return wrapper
+
+    result['tile_all_windows'] = timeit(
+        sync_after(lambda: vscreen().tile_all_windows(vscreen().current_focused_window)),
+        repeat)
+    result['select_other_window'] = timeit(
+        sync_after(lambda: vscreen().select_other_window(vscreen().current_focused_window)),
+        repeat)
+
+    def switch_vscreen():
+        manager.select_vscreen(2)
+        wm.display.sync()
+        manager.select_vscreen(1)
+        wm.display.sync()
+        # drain the UnmapNotify/MapNotify flood as the event loop does
+        pump()
+
+    result['select_vscreen'] = timeit(switch_vscreen, repeat) / 2
+
+    # drag throughput: feed synthetic motion events as the event loop
+    # does, applying the newest position after every burst
+    window = vscreen().current_focused_window
+    geom = window.get_geometry()
+    x, y = geom.x + 10, geom.y + 10
+    handler.handle_button_press(types.SimpleNamespace(
+        child=window, detail=1, root_x=x, root_y=y))
+    nevents, burst = 1000 * repeat // DEFAULT_REPEAT, 4
+    start = time.perf_counter()
+    for i in range(nevents):
+        handler.handle_motion_notify(types.SimpleNamespace(
+            root_x=x + i % 200, root_y=y + i % 100))
+        if i % burst == burst - 1:
+            handler.apply_drag(force=True)
+            wm.display.flush()
+    wm.display.sync()
+    elapsed = time.perf_counter() - start
+    handler.handle_button_release(None)
+    result['drag_events_per_second'] = nevents / elapsed
+
+    wm.display.close()
+    clients.display.close()
+    return result
+
+
+# ------------------------ comparison
+# metrics which are better when larger
+HIGHER_IS_BETTER = {'drag_events_per_second'}
+
+
+def compare(results, baseline, tolerance):
+    '''Print the ratio of RESULTS to BASELINE and return the list of
+    regressions exceeding TOLERANCE.'''
+    regressions = []
+    for nclients, metrics in sorted(results.items(), key=lambda item: int(item[0])):
+        base_metrics = baseline.get(nclients, {})
+        for metric, value in sorted(metrics.items()):
+            base = base_metrics.get(metric, None)
+            if not base:
+                print(f'{nclients}\t{metric}\t{value:.6g}\t-')
+                continue
+            ratio = value / base
+            slower = 1 / ratio if metric in HIGHER_IS_BETTER else ratio
+            mark = ''
+            if slower > 1 + tolerance:
+                mark = '\tREGRESSION'
+                regressions.append((nclients, metric, ratio))
+            print(f'{nclients}\t{metric}\t{value:.6g}\t{ratio:.3f}{mark}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--clients', type=int, nargs='+', default=DEFAULT_CLIENTS)
+    parser.add_argument('-r', '--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('-d', '--display', type=int, default=99,
+                        help='the first display number used for Xvfb')
+    parser.add_argument('-o', '--output', help='write the result as JSON')
+    parser.add_argument('-b', '--baseline', help='compare with the JSON of a former result')
+    parser.add_argument('-t', '--tolerance', type=float, default=.2,
+                        help='allowed slowdown ratio against the baseline')
+    parser.add_argument('--run-one', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one is not None:
+        json.dump(run_one(args.run_one, args.display, args.repeat), sys.stdout)
+        return 0
+
+    results = {}
+    for i, nclients in enumerate(args.clients):
+        output = subprocess.check_output(
+            [sys.executable, '-m', 'xpywm.benchmark.bench', '--run-one', str(nclients),
+             '--display', str(args.display + i), '--repeat', str(args.repeat)])
+        results[str(nclients)] = json.loads(output)
+
+    document = {
+        'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                 'python': platform.python_version(),
+                 'host': platform.node(),
+                 'repeat': args.repeat},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        return 1 if regressions else 0
+    json.dump(document, sys.stdout, indent=2)
+    print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
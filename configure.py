@@ -8,14 +8,39 @@ from Xlib import X
 MAX_VSCREEN = 2
 FRAME_WIDTH = 2
 FRAME_COLOR = os.environ.get('THEME_COLOR', 'aquamarine1')
+# 'strips' -> four frame windows, 'shape' -> a single window shaped with
+# the SHAPE extension, 'reparent' -> every window is reparented into its
+# own frame
+FRAME_MODE = 'strips'
+# the frame color of unfocused windows in 'reparent' mode
+FRAME_INACTIVE_COLOR = 'gray30'
 Y_OFFSET = 8
+# compare the in-memory window geometry with the X server (for debugging)
+GEOMETRY_CROSSCHECK = False
 
 TRANSSET_ALPHA = '.85'
 INTRANSSET_CLS = r'emacs|mupdf|mplayer|code'
 
+# the maximum rate of window repositioning/resizing while dragging;
+# None -> the refresh rate of the monitor
+DRAG_MAX_FPS = None
+DRAG_DEFAULT_FPS = 60
+
+# grab the server while re-tiling/re-layouting windows, so that all
+# windows are moved in a single visual update
+CONFIGURE_GRAB_SERVER = True
+
+# hold the windows of each vscreen in a root-sized container window, so
+# that switching vscreens is a single map and unmap
+VSCREEN_CONTAINERS = False
+
+# re-tile the current vscreen when a monitor is (un)plugged
+RETILE_ON_HOTPLUG = False
+
 POINTER_OFFSET = 16
 DEFAULT_POINTER_GEOMETRY = {'x': 1, 'y': 0}
 STOP_CURSOR_CLS = r'rxvt|emacs'
+TOUCHPAD_REGEXP = r'touchpad|synaptics|trackpad'
 
 LAYOUT_RULES = {
     r'xterm|rxvt': [.5, .3, 1 - .5, .7],
@@ -26,39 +51,11 @@ LAYOUT_RULES = {
     [.5, 0, .5, 1],
 }
 
-TILE_COUNTS = {
-    0: [0, 0],
-    1: [1, 1],
-    2: [2, 1],
-    3: [2, 2],
-    4: [2, 2],
-    5: [3, 2],
-    6: [3, 2],
-    7: [3, 3],
-    8: [3, 3],
-    9: [3, 3],
-    10: [4, 3],
-    11: [4, 3],
-    12: [4, 3],
-    13: [4, 4],
-    14: [4, 4],
-    15: [4, 4],
-    16: [4, 4],
-    17: [5, 4],
-    18: [5, 4],
-    19: [5, 4],
-    20: [5, 4],
-    21: [5, 5],
-    22: [5, 5],
-    23: [5, 5],
-    24: [5, 5],
-    25: [5, 5],
-    26: [6, 5],
-    27: [6, 5],
-    28: [6, 5],
-    29: [6, 5],
-    30: [6, 5],
-}
+# tiling layouts (see vscreen/layout.py), selectable per vscreen
+TILE_LAYOUT = 'grid'
+TILE_LAYOUTS = ['grid', 'master_stack', 'spiral']
+# re-tile vscreens automatically when a window is mapped or unmapped
+AUTO_TILE = False
 
 KEY_HANDLER = {
     # for debugging
@@ -99,6 +96,14 @@ KEY_HANDLER = {
     'm': {'modifier': X.Mod1Mask | X.ControlMask,
           'type': 'vscreen',
           'method': 'horizontal_split_windows'},
+    'l': {'modifier': X.Mod1Mask | X.ControlMask,
+          'type': 'vscreen',
+          'method': 'cycle_tile_layout',
+          'first_arg_window': True},
+    'semicolon': {'modifier': X.Mod1Mask | X.ControlMask,
+                  'type': 'vscreen',
+                  'method': 'toggle_auto_tile',
+                  'first_arg_window': True},
     'bar': {'modifier': X.Mod1Mask | X.ControlMask,
             'type': 'vscreen',
             'method': 'toggle_pip_window',
@@ -162,17 +167,23 @@ KEY_HANDLER = {
     # os-command - sound
     'XF86AudioRaiseVolume': {'modifier': X.NONE,
                              'type': 'external_command',
-                             'method': 'audio_raise_volume'},
+                             'method': 'audio_raise_volume',
+                             'args': 5, 'coalesce': True},
     'XF86AudioLowerVolume': {'modifier': X.NONE,
                              'type': 'external_command',
-                             'method': 'audio_lower_volume'},
+                             'method': 'audio_lower_volume',
+                             'args': 5, 'coalesce': True},
     'XF86AudioMute': {'modifier': X.NONE,
                       'os_command': 'audio-toggle-mute'},
     # os-command - backlight
     'XF86MonBrightnessUp': {'modifier': X.NONE,
-                            'os_command': 'backlight -inc 10'},
+                            'type': 'external_command',
+                            'method': 'backlight_increase',
+                            'args': 10, 'coalesce': True},
     'XF86MonBrightnessDown': {'modifier': X.NONE,
-                              'os_command': 'backlight -dec 10'},
+                              'type': 'external_command',
+                              'method': 'backlight_decrease',
+                              'args': 10, 'coalesce': True},
     'a': {'modifier': X.Mod1Mask | X.ControlMask,
           'type': 'external_command',
           'method': 'backlight_toggle',
@@ -189,4 +200,37 @@ KEY_HANDLER = {
 KEY_HANDLER['d'] = KEY_HANDLER['i']
 
 
+# auto-repeated presses of keys with 'coalesce' (whose first argument is
+# a delta) are merged: the first press is applied at once, and the
+# presses following it within COALESCE_REPEAT_DELAY seconds (the
+# auto-repeat delay) and then within COALESCE_INTERVAL seconds of each
+# other are accumulated and applied at most every COALESCE_MAX_DELAY
+# seconds
+COALESCE_INTERVAL = .2
+COALESCE_REPEAT_DELAY = .7
+COALESCE_MAX_DELAY = .4
+
+# files of each user and display
+RUNTIME_DIR = os.environ.get('XDG_RUNTIME_DIR') or os.path.expanduser('~')
+RUNTIME_NAME = 'xpywm-{}'.format(os.environ.get('DISPLAY', '').replace('/', '_'))
+
+# the socket accepting commands from scripts (see util/ipc.py); None
+# -> disabled
+IPC_SOCKET = os.path.join(RUNTIME_DIR, RUNTIME_NAME + '.sock')
+
+# mixer control for volume keys; the cached level is re-read after
+# MIXER_CACHE_TTL seconds (None -> never)
+MIXER_CONTROL = 'Master'
+MIXER_CACHE_TTL = 60
+
+# external commands
+EXECUTOR_MAX_WORKERS = 4
+EXECUTOR_MAX_CONCURRENT = 16
+EXECUTOR_TIMEOUT = 10
+
 LOG_FILE = '/var/tmp/xpywm.log'
+# event loop statistics are dumped to STATS_FILE on SIGUSR1
+STATS_FILE = os.path.join(RUNTIME_DIR, RUNTIME_NAME + '.stats')
+# account X requests and round trips for each event handler and method
+# (reported with the statistics)
+XTRACE = False
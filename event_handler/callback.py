@@ -1,54 +1,106 @@
 #!/usr/bin/env python3
 
+import functools
 import os
 import logging
-import subprocess
 import sys
+import time
 
-from xpywm.util import external_command
+from xpywm.util import external_command, snapshot
+from xpywm.util.coalesce import coalescer
+from xpywm.util.executor import executor
+from xpywm.util.stats import stats
+from xpywm.util.xtrace import xtrace
 
 
 class Callback():
     def __init__(self, vscreen_manager):
         self.vscreen_manager = vscreen_manager
+        # util.ipc.CommandServer, closed before restart
+        self.command_server = None
 
-    def call(self, event, entry):
-        if 'os_command' in entry:
-            os.system(entry['os_command'] + ' &')
-        else:
-            self.call_method(event, entry)
-
-    def call_method(self, event, entry):
-        object_ = {
+    def target(self, type_):
+        '''Return the object on which the actions of TYPE_ are called, or
+        None.'''
+        if type_ == 'vscreen':
+            return self.vscreen_manager.current_vscreen
+        return {
             'vscreen_manager': self.vscreen_manager,
-            'vscreen': self.vscreen_manager.current_vscreen,
             'callback': self,
             'pointer': self.vscreen_manager.pointer,
             'external_command': external_command,
-        }[entry['type']]
-        method = getattr(object_, entry['method'], None)
-        if not method:
-            logging.error("unable to call '%s'", entry['method'])
-            return
+            'stats': stats,
+        }.get(type_, None)
+
+    def compile(self, entry):
+        '''Return the function called with the KeyPress event for the
+        action ENTRY of configure.KEY_HANDLER, or None if ENTRY is invalid.
+        The target object and the method are looked up only once, except
+        the current vscreen, which is looked up at every call.'''
+        if 'os_command' in entry:
+            command, limit = entry['os_command'], entry.get('max_concurrent', None)
+
+            def action(event):
+                start = time.perf_counter()
+                executor.launch(command, limit=limit)
+                stats.record('callback.os_command', time.perf_counter() - start)
+            action.__name__ = 'os_command'
+            return action
+
+        type_, name = entry.get('type'), entry.get('method')
+        if type_ == 'vscreen':
+            # all vscreens are of the same class
+            function = getattr(type(self.vscreen_manager.current_vscreen), name, None)
+            method = function and functools.partial(self._call_vscreen, function)
+        else:
+            method = getattr(self.target(type_), name, None)
+        if not callable(method):
+            logging.error("unable to call '%s'", name)
+            return None
 
         args = entry.get('args', ())
         if type(args) is not tuple:
             # convert to tuple via list because arguments of tuple
             # must be iteratable
             args = tuple([args])
+        first_arg_window = entry.get('first_arg_window', False)
+        key = 'callback.{}.{}'.format(type_, name)
+
+        def call(event, args):
+            start = time.perf_counter()
+            previous = xtrace.enter(key)
+            try:
+                if first_arg_window:
+                    method(self.vscreen_manager.client_window(event.child), *args)
+                else:
+                    method(*args)
+            finally:
+                xtrace.leave(previous)
+            stats.record(key, time.perf_counter() - start)
 
-        if entry.get('first_arg_window', False):
-            window = event.child
-            method(window, *args)
+        if entry.get('coalesce', False) and args:
+            # merge auto-repeats into a call with the accumulated delta,
+            # which is the first argument
+            def action(event):
+                coalescer.press(key, lambda delta: call(event, (delta, *args[1:])), args[0])
         else:
-            method(*args)
+            def action(event):
+                call(event, args)
+        action.__name__ = key
+        return action
+
+    def _call_vscreen(self, function, *args):
+        return function(self.vscreen_manager.current_vscreen, *args)
 
     # ------------------------
     def raise_emacs(self):
-        if subprocess.getoutput('pidof emacs'):
-            self.vscreen_manager.pull_class_window('emacs')
-        else:
-            os.system('emacs &')
+        def callback(output):
+            if output:
+                self.vscreen_manager.pull_class_window('emacs')
+            else:
+                executor.launch('emacs', limit=1)
+
+        executor.run('pidof emacs', callback)
 
     def cb_screenshot(self, window):
         try:
@@ -57,6 +109,13 @@ class Callback():
             pass
 
     def restart(self):
-        self.vscreen_manager.all_window_move_init_vscreen()
+        '''Restart the window manager.  The state of vscreens is passed to
+        the new process through the root window property, so the layout is
+        unchanged after restart.'''
+        displaysize = self.vscreen_manager.displaysize
+        snapshot.save(displaysize.display, displaysize.screen,
+                      self.vscreen_manager.dump_state())
+        if self.command_server is not None:
+            self.command_server.close()
         logging.info('restarting %s...', sys.argv[0])
         os.execvp(sys.argv[0], [sys.argv[0]])
@@ -1,12 +1,20 @@
 #!/usr/bin/env python3
 
 import logging
+import select
+import time
 
-from Xlib import X, XK
+from Xlib import X, XK, Xatom
+from Xlib.ext import randr
 
 from xpywm import configure
 from xpywm.event_handler import keysyms
 from xpywm.event_handler import callback
+from xpywm.util import ipc, window_geometry, window_property
+from xpywm.util.coalesce import coalescer
+from xpywm.util.executor import executor
+from xpywm.util.stats import stats
+from xpywm.util.xtrace import xtrace
 
 EVENT_HANDLER = {
     X.KeyPress: 'handle_keypress',
@@ -20,10 +28,14 @@ EVENT_HANDLER = {
     X.LeaveNotify: 'handle_leave_notify',
     X.DestroyNotify: 'handle_destroy_notify',
     X.MapNotify: 'handle_map_notify',
+    X.PropertyNotify: 'handle_property_notify',
+    X.ConfigureNotify: 'handle_configure_notify',
+    X.MappingNotify: 'handle_mapping_notify',
 }
 
-DRAG_THRESH = 16
 MIN_WIN_SIZE = 16
+# Shift, Lock, Control and Mod1-Mod5 in the state of KeyPress events
+KEY_MODIFIER_MASK = 0xff
 BOUNCE_RATIO = 1 / 8
 
 
@@ -35,14 +47,31 @@ class EventHandler():
         self.callback = callback.Callback(vscreen_manager)
 
         self.key_handlers = {}
+        self.event_handlers = dict(EVENT_HANDLER)
+        self.retile_pending = False
 
         self.drag_window = None
         self.drag_button = None
         self.drag_geometry = None
         self.drag_start_xy = None
-        self.drag_last_xy = None
+        # the newest pointer position not yet applied to the window
+        self.drag_pending_xy = None
+        self.drag_last_time = 0
+        self.drag_interval = self._drag_interval()
+
+        executor.install_sigchld_handler()
+        stats.install_signal_handler()
+
+        self.command_server = None
+        if configure.IPC_SOCKET:
+            try:
+                self.command_server = ipc.CommandServer(self.callback)
+                self.callback.command_server = self.command_server
+            except OSError:
+                logging.exception('unable to open %s', configure.IPC_SOCKET)
 
         self.catch_events()
+        self.catch_xrandr_events()
         self.grab_keys()
         self.grab_buttons()
 
@@ -53,20 +82,78 @@ class EventHandler():
                 | X.EnterWindowMask | X.LeaveWindowMask | X.FocusChangeMask)
         self.screen.root.change_attributes(event_mask=mask)
 
+    def catch_xrandr_events(self):
+        '''Dispatch RandR events, whose event codes are assigned by the X
+        server.'''
+        extension = self.display.query_extension('RANDR')
+        if extension is None:
+            return
+        for code in [randr.RRScreenChangeNotify, randr.RRNotify]:
+            self.event_handlers[extension.first_event + code] = 'handle_xrandr_notify'
+
     def grab_keys(self):
-        for string, entry in configure.KEY_HANDLER.items():
-            keysym = XK.string_to_keysym(string)
-            # FIXME: use keysymdef/xf86.py
-            if not keysym and string in keysyms.KEYSYM_TBL:
-                keysym = keysyms.KEYSYM_TBL[string]
-            keycode = self.display.keysym_to_keycode(keysym)
-            if not keycode:
-                continue
+        '''Compile configure.KEY_HANDLER into the jump table
+        `self.key_handlers', and grab the keys.  An entry of KEY_HANDLER is
+        an action or a list of actions with different modifiers.'''
+        # (key string, modifier) -> action
+        self.key_bindings = {}
+        for string, entries in configure.KEY_HANDLER.items():
+            if isinstance(entries, dict):
+                entries = [entries]
+            for entry in entries:
+                action = self.callback.compile(entry)
+                if action:
+                    self.key_bindings[string, entry.get('modifier', X.NONE)] = action
+        # (key string, modifier) -> grabbed keycode
+        self.key_codes = {}
+        self._update_lock_masks()
+        for binding in self.key_bindings:
+            self._grab_key(binding)
+
+    def _update_lock_masks(self):
+        '''Find the modifier of NumLock.  Every key is grabbed with all
+        combinations of CapsLock and NumLock, which are ignored in
+        dispatching.'''
+        numlock = X.NONE
+        keycode = self.display.keysym_to_keycode(XK.XK_Num_Lock)
+        for i, keycodes in enumerate(self.display.get_modifier_mapping()):
+            if keycode and keycode in keycodes:
+                numlock = 1 << i
+        self.lock_mask = X.LockMask | numlock
+        self.lock_masks = sorted({X.NONE, X.LockMask, numlock, self.lock_mask})
 
-            modifier = entry.get('modifier', X.NONE)
-            self.screen.root.grab_key(keycode, modifier, True, X.GrabModeAsync,
+    def _keycode(self, string):
+        keysym = XK.string_to_keysym(string)
+        # FIXME: use keysymdef/xf86.py
+        if not keysym and string in keysyms.KEYSYM_TBL:
+            keysym = keysyms.KEYSYM_TBL[string]
+        return self.display.keysym_to_keycode(keysym)
+
+    def _grab_key(self, binding):
+        string, modifier = binding
+        keycode = self._keycode(string)
+        self.key_codes[binding] = keycode
+        if not keycode:
+            return
+        self.key_handlers[keycode, modifier] = self.key_bindings[binding]
+        for lock in self.lock_masks:
+            self.screen.root.grab_key(keycode, modifier | lock, True, X.GrabModeAsync,
                                       X.GrabModeAsync)
-            self.key_handlers[keycode] = entry
+
+    def _ungrab_key(self, binding):
+        keycode = self.key_codes.pop(binding, None)
+        if not keycode:
+            return
+        modifier = binding[1]
+        others = [other for other, other_keycode in self.key_codes.items()
+                  if other_keycode == keycode and other[1] == modifier]
+        if others:
+            # another key string resolves to the same keycode
+            self.key_handlers[keycode, modifier] = self.key_bindings[others[0]]
+            return
+        self.key_handlers.pop((keycode, modifier), None)
+        for lock in self.lock_masks:
+            self.screen.root.ungrab_key(keycode, modifier | lock)
 
     def grab_buttons(self):
         '''Configure the root window to receive mouse button events.'''
@@ -77,22 +164,42 @@ class EventHandler():
 
     def handle_keypress(self, event):
         '''Event handler for KeyPress events.  Callback functions for every
-        key combination are defined in the variable `KEYBOARD_HANDLER', from
-        which the jump table (dictionary mapping from a keycode to the
-        corresponding action entry is composed and stored in
-        `self.key_handlers'.'''
+        key combination are defined in the variable `KEY_HANDLER', from
+        which the jump table (dictionary mapping from a keycode and a
+        modifier without CapsLock and NumLock to the compiled action) is
+        composed and stored in `self.key_handlers'.'''
         keycode = event.detail
-        entry = self.key_handlers.get(keycode, None)
-        if not entry:
+        modifier = event.state & KEY_MODIFIER_MASK & ~self.lock_mask
+        action = self.key_handlers.get((keycode, modifier), None)
+        if not action:
+            return
+        logging.info('%s -> %s', keycode, action.__name__)
+        action(event)
+
+    def handle_mapping_notify(self, event):
+        '''Event handler for MappingNotify events.  Grab again only the keys
+        whose keycode is changed, or all keys if the modifier mapping (and
+        possibly NumLock) is changed.'''
+        self.display.refresh_keyboard_mapping(event)
+        if event.request == X.MappingKeyboard:
+            changed = [binding for binding, keycode in self.key_codes.items()
+                       if keycode != self._keycode(binding[0])]
+        elif event.request == X.MappingModifier:
+            changed = list(self.key_codes)
+        else:
             return
-        logging.info('%s -> %s', keycode, entry)
-        self.callback.call(event, entry)
+        for binding in changed:
+            self._ungrab_key(binding)
+        if event.request == X.MappingModifier:
+            self._update_lock_masks()
+        for binding in changed:
+            self._grab_key(binding)
 
     def handle_button_press(self, event):
         '''Initiate window repositioning with the button 1 or window resizing
         with the button 3.  All mouse pointer motion events are captured until
         the button is relased.'''
-        window = event.child
+        window = self.vscreen_manager.client_window(event.child)
         if not self.vscreen_manager.exist(window):
             return
 
@@ -101,33 +208,63 @@ class EventHandler():
             X.GrabModeAsync, X.NONE, X.NONE, 0)
         self.drag_window = window
         self.drag_button = event.detail
-        self.drag_geometry = window.get_geometry()
-        self.drag_start_xy = self.drag_last_xy = event.root_x, event.root_y
+        self.drag_geometry = window_geometry.get_geometry(window)
+        self.drag_start_xy = event.root_x, event.root_y
+        self.drag_pending_xy = None
+        # the refresh rate may have changed with the monitor layout
+        self.drag_interval = self._drag_interval()
 
     def handle_button_release(self, event):
         '''Terminate window repositioning/resizing.'''
         self.display.ungrab_pointer(0)
+        # apply the final position regardless of the rate limit
+        self.apply_drag(force=True)
+        self.drag_window = None
 
     def handle_motion_notify(self, event):
-        '''Reposition or resize the current window according to the current
+        '''Record the current pointer position.  Only the newest position of
+        the queued MotionNotify events is applied by apply_drag() after
+        the event queue is drained.'''
+        if self.drag_window is None:
+            return
+        self.drag_pending_xy = event.root_x, event.root_y
+
+    def _drag_interval(self):
+        return 1 / (configure.DRAG_MAX_FPS
+                    or self.vscreen_manager.displaysize.get_refresh_rate()
+                    or configure.DRAG_DEFAULT_FPS)
+
+    def drag_timeout(self):
+        '''Return the seconds until the pending drag position can be
+        applied, or None if nothing is pending.'''
+        if self.drag_pending_xy is None:
+            return None
+        return max(0, self.drag_last_time + self.drag_interval - time.monotonic())
+
+    def apply_drag(self, force=False):
+        '''Reposition or resize the current window according to the newest
         pointer position.  The maximum rate of repositioning and resizeing is
         bounded by DRAG_MAX_FPS.'''
-        x, y = event.root_x, event.root_y
-        # prevent to reposition window too frequently
-        if abs(x - self.drag_last_xy[0]) + abs(
-                y - self.drag_last_xy[1]) <= DRAG_THRESH:
+        if self.drag_pending_xy is None or self.drag_window is None:
+            return
+        now = time.monotonic()
+        if not force and now < self.drag_last_time + self.drag_interval:
             return
-        self.drag_last_xy = x, y
+        self.drag_last_time = now
+        x, y = self.drag_pending_xy
+        self.drag_pending_xy = None
 
         dx = x - self.drag_start_xy[0]
         dy = y - self.drag_start_xy[1]
         if self.drag_button == 1:
             # reposition
-            self.drag_window.configure(x=self.drag_geometry.x + dx,
-                                       y=self.drag_geometry.y + dy)
+            window_geometry.configure(self.drag_window,
+                                      x=self.drag_geometry.x + dx,
+                                      y=self.drag_geometry.y + dy)
         else:
             # resize
-            self.drag_window.configure(
+            window_geometry.configure(
+                self.drag_window,
                 width=max(MIN_WIN_SIZE, self.drag_geometry.width + dx),
                 height=max(MIN_WIN_SIZE, self.drag_geometry.height + dy))
         self.vscreen_manager.frame_window.draw_frame_windows(self.drag_window)
@@ -137,20 +274,43 @@ class EventHandler():
         window = event.window
         vscreen = self.vscreen_manager.current_vscreen
         vscreen.manage_window(window)
+        vscreen.auto_tile_window(window)
         vscreen.select_window(window)
 
     def handle_unmap_notify(self, event):
         '''Event handler for UnmapNotify events.'''
         window = event.window
         vscreen = self.vscreen_manager.current_vscreen
+        frame_window = self.vscreen_manager.frame_window
+        container_window = self.vscreen_manager.container_window
+        if container_window is not None or frame_window.mode == 'reparent':
+            # with containers or frames, only clients unmap (withdraw)
+            # their windows, which may be on a hidden vscreen
+            if frame_window.ignore_unmap(window):
+                return
+            if container_window is not None and container_window.ignore_unmap(window):
+                return
+            vscreen = self.vscreen_manager.is_vscreen_of(window)
+            if vscreen is None:
+                return
+            if not frame_window.release(window) and container_window is not None:
+                container_window.release(window)
         vscreen.unmanage_window(window)
         self.vscreen_manager.frame_window.clear_frame_window(window)
+        vscreen.auto_untile_window(window)
 
     def handle_map_notify(self, event):
         '''Event handler for MapNotify events.'''
         window = event.window
         if window in self.vscreen_manager.frame_window.frame_windows.values():
             return
+        container_window = self.vscreen_manager.container_window
+        if container_window is not None and container_window.is_container(window):
+            return
+        # e.g. restored to a hidden vscreen and unmapped by close(), or
+        # mapped again by reparenting into the container of another vscreen
+        if self.vscreen_manager.exist(window) or self.vscreen_manager.is_pip_window(window):
+            return
         vscreen = self.vscreen_manager.current_vscreen
         vscreen.manage_window(window)
 
@@ -174,6 +334,32 @@ class EventHandler():
         vscreen.unmanage_window(window)
         vscreen.pointer.remove_geometry_of(window)
         self.vscreen_manager.frame_window.clear_frame_window(window)
+        vscreen.auto_untile_window(window)
+        self.vscreen_manager.frame_window.detach(window)
+        window_property.cache.evict(window)
+        window_geometry.model.forget(window)
+        if self.vscreen_manager.container_window is not None:
+            self.vscreen_manager.container_window.forget(window)
+
+    def handle_property_notify(self, event):
+        '''Event handler for PropertyNotify events.  Invalidate the cached
+        property of the window.'''
+        window_property.cache.update(event.window, event.atom)
+        if event.atom == Xatom.WM_CLASS:
+            self.vscreen_manager.registry.reindex(event.window)
+
+    def handle_xrandr_notify(self, event):
+        '''Event handler for RandR ScreenChangeNotify and RRNotify (CRTC and
+        output changes) events.'''
+        self.vscreen_manager.displaysize.invalidate()
+        # resize the containers and re-tile once after the burst of events
+        # is drained
+        self.retile_pending = True
+
+    def handle_configure_notify(self, event):
+        '''Event handler for ConfigureNotify events.  Keep the geometry model
+        current.'''
+        window_geometry.model.update_from_event(event)
 
     def handle_configure_request(self, event):
         '''Event handler for ConfigureRequest events.'''
@@ -182,27 +368,82 @@ class EventHandler():
         width, height = event.width, event.height
         mask = event.value_mask
         if mask == 0b1111:
-            window.configure(x=x, y=y, width=width, height=height)
+            window_geometry.configure(window, x=x, y=y, width=width, height=height)
         elif mask == 0b1100:
-            window.configure(width=width, height=height)
+            window_geometry.configure(window, width=width, height=height)
         elif mask == 0b0011:
-            window.configure(x=x, y=y)
+            window_geometry.configure(window, x=x, y=y)
         elif mask == 0b01000000:
-            window.configure(event.stack_mode)
+            window_geometry.configure(window, stack_mode=event.stack_mode)
+
+    def dispatch(self, event):
+        '''Dispatch an appropriate handler for the event EVENT if possible.
+        The latency of each event type and handler is recorded in stats.'''
+        start = time.perf_counter()
+        event_time = getattr(event, 'time', None)
+        if event_time:
+            stats.observe_event_time(event_time)
+        type_ = event.type
+        if type_ is X.KeyPress:
+            # Templary save the geomery of pointer here. Because
+            # when LeaveNotify is raised, pointer is already moved
+            # away.
+            self.vscreen_manager.pointer.save_temporary_geometry()
+        if type_ in self.event_handlers:
+            name = self.event_handlers[type_]
+            handler = getattr(self, name, None)
+            if handler:
+                previous = xtrace.enter(name)
+                try:
+                    handler(event)
+                finally:
+                    xtrace.leave(previous)
+                stats.record(name, time.perf_counter() - start)
+        stats.record('event.' + type(event).__name__, time.perf_counter() - start)
+
+    def retile(self):
+        '''Follow the monitor layout changed by RandR events.'''
+        if self.vscreen_manager.container_window is not None:
+            self.vscreen_manager.container_window.resize()
+        if configure.RETILE_ON_HOTPLUG:
+            vscreen = self.vscreen_manager.current_vscreen
+            vscreen.tile_all_windows(vscreen.current_focused_window)
+
+    def dispatch_pending_events(self):
+        '''Dispatch all queued events.  Queued MotionNotify events are
+        compressed into the newest one.'''
+        while True:
+            depth = self.display.pending_events()
+            if depth:
+                stats.observe('queue_depth', depth)
+                self.dispatch(self.display.next_event())
+                continue
+            self.apply_drag()
+            if self.retile_pending:
+                self.retile_pending = False
+                self.retile()
+            # round trips above may have read new events into the queue,
+            # which select() does not see
+            if not self.display.pending_events():
+                break
 
     def event_loop(self):
         '''The main event loop of the window manager.  Continuously receive an
         event from the X11 server, and dispatch an appropriate handler if
         possible.'''
         while True:
-            event = self.display.next_event()
-            type_ = event.type
-            if type_ is X.KeyPress:
-                # Templary save the geomery of pointer here. Because
-                # when LeaveNotify is raised, pointer is already moved
-                # away.
-                self.vscreen_manager.pointer.save_temporary_geometry()
-            if type_ in EVENT_HANDLER:
-                handler = getattr(self, EVENT_HANDLER[type_], None)
-                if handler:
-                    handler(event)
+            self.dispatch_pending_events()
+            self.display.flush()
+            timeouts = [timeout for timeout in [self.drag_timeout(), coalescer.timeout()]
+                        if timeout is not None]
+            readers, writers = [self.display, executor], []
+            if self.command_server is not None:
+                readers.extend(self.command_server.readers())
+                writers.extend(self.command_server.writers())
+            readable, writable, _ = select.select(readers, writers, [],
+                                                  min(timeouts, default=None))
+            if executor in readable:
+                executor.dispatch()
+            if self.command_server is not None:
+                self.command_server.dispatch(readable, writable)
+            coalescer.dispatch()
@@ -2,11 +2,19 @@
 
 import logging
 import sys
+import time
 
+import Xlib
 from Xlib import display
+from Xlib.protocol import request
 
+from xpywm import configure
 from xpywm.event_handler.event_handler import EventHandler
+from xpywm.util import snapshot, window_geometry, window_property
+from xpywm.util.stats import stats
+from xpywm.util.xtrace import xtrace
 from xpywm.vscreen.vscreen_manager import VScreenManager
+from xpywm.xwindow_component.container_window import ContainerWindow
 from xpywm.xwindow_component.frame_window import FrameWindow
 from xpywm.xwindow_component.pointer import Pointer
 from xpywm.xwindow_component.displaysize import DisplaySize
@@ -24,28 +32,83 @@ class WindowManager():
     def __init__(self):
         self.display = display.Display()
         self.screen = self.display.screen()
+        stats.reporters.append(window_property.cache.report)
+        if configure.XTRACE:
+            xtrace.install(self.display)
+            stats.reporters.append(xtrace.report)
+        previous = xtrace.enter('startup')
 
         self.pointer = Pointer(self.display, self.screen)
-        self.frame_window = FrameWindow(self.screen)
+        self.frame_window = FrameWindow(self.display, self.screen)
+        container_window = None
+        if configure.VSCREEN_CONTAINERS:
+            container_window = ContainerWindow(self.display, self.screen)
         self.vscreen_manager = VScreenManager(self.pointer,
                                               self.frame_window,
-                                              DisplaySize(self.display, self.screen))
+                                              DisplaySize(self.display, self.screen),
+                                              container_window)
 
         self.event_handler = EventHandler(self.display, self.screen, self.vscreen_manager)
 
-        self._manage_exist_windows()
+        restored = self._manage_exist_windows()
 
         # create frame windows here because frame windows is managed
         # if create them before _manage_exist_windows()
         self.frame_window.create_frame_windows()
-        # choose first window
-        self.vscreen_manager.current_vscreen.select_other_window()
+        vscreen = self.vscreen_manager.current_vscreen
+        if restored and vscreen.current_focused_window is not None:
+            vscreen.select_window(vscreen.current_focused_window)
+        else:
+            # choose first window
+            vscreen.select_other_window()
+        xtrace.leave(previous)
 
     def _manage_exist_windows(self):
-        # manage exist windows
-        for child in self.screen.root.query_tree().children:
-            if child.get_attributes().map_state:
-                self.vscreen_manager.current_vscreen.manage_window(child)
+        '''Manage exist windows.  The attributes, properties and geometries
+        of all children are requested in batches without waiting for
+        each reply.  If the state is saved by the last process (see
+        Callback.restart), windows are restored to their vscreens,
+        including unmapped ones.  Return True if the state is restored.'''
+        times = [time.perf_counter()]
+        state = snapshot.load(self.display, self.screen)
+        state_ids = VScreenManager.state_window_ids(state) if state else set()
+        children = self.screen.root.query_tree().children
+        times.append(time.perf_counter())
+
+        requests = [(child, request.GetWindowAttributes(display=self.display.display,
+                                                        defer=True, window=child.id))
+                    for child in children]
+        windows = []
+        for child, attrs in requests:
+            try:
+                attrs.reply()
+            except Xlib.error.XError:
+                continue
+            if (attrs.map_state or child.id in state_ids) and not attrs.override_redirect:
+                windows.append((child, attrs))
+        times.append(time.perf_counter())
+
+        targets = [child for child, attrs in windows]
+        window_property.cache.prefetch(targets)
+        window_geometry.model.prefetch(targets)
+        times.append(time.perf_counter())
+
+        if state:
+            remains = {child.id: (child, attrs) for child, attrs in windows}
+            self.vscreen_manager.restore_state(state, remains)
+            windows = [(child, attrs) for child, attrs in remains.values()
+                       if attrs.map_state]
+        for child, attrs in windows:
+            self.vscreen_manager.current_vscreen.manage_window(child, attrs)
+        self.display.flush()
+        times.append(time.perf_counter())
+
+        logging.info('adopt %d/%d windows: %s', len(windows), len(children),
+                     ' '.join('{} {:.1f}ms'.format(phase, (end - start) * 1000)
+                              for phase, start, end in zip(
+                                  ['query_tree', 'attributes', 'properties', 'manage'],
+                                  times, times[1:])))
+        return bool(state)
 
     def start(self):
         logging.info('start %s', sys.argv[0])
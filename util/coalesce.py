@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import time
+
+from xpywm import configure
+
+
+class Coalescer():
+    '''Merge auto-repeated key presses of an action into a single call with
+    the accumulated delta.  The first press is applied immediately.  The
+    following presses, the first of which comes within
+    configure.COALESCE_REPEAT_DELAY and the others within
+    COALESCE_INTERVAL of each other, are accumulated, and applied when
+    the key is released (no press for COALESCE_INTERVAL) or at most every
+    COALESCE_MAX_DELAY seconds while the key is held.  dispatch() must be
+    called when timeout() expires.
+
+    '''
+
+    def __init__(self):
+        # key -> [function, accumulated delta]
+        self.pending = {}
+        self.last_press = {}
+        self.last_call = {}
+
+    # ------------------------
+    def press(self, key, function, delta):
+        '''Call FUNCTION(DELTA) for a press of the action KEY, or defer it
+        if the press is an auto-repeat.'''
+        now = time.monotonic()
+        last_press = self.last_press.get(key, None)
+        self.last_press[key] = now
+        # the first auto-repeat comes after the auto-repeat delay
+        if key not in self.pending and \
+           (last_press is None or now - last_press > configure.COALESCE_REPEAT_DELAY):
+            self._call(key, function, delta, now)
+            return
+        entry = self.pending.setdefault(key, [function, 0])
+        entry[0] = function
+        entry[1] += delta
+
+    def timeout(self):
+        '''Return the seconds until the next deferred call, or None.'''
+        if not self.pending:
+            return None
+        now = time.monotonic()
+        return max(0, min(self._deadline(key) for key in self.pending) - now)
+
+    def dispatch(self):
+        '''Call the deferred functions whose deadline has come.'''
+        now = time.monotonic()
+        for key in [key for key in self.pending if self._deadline(key) <= now]:
+            function, delta = self.pending.pop(key)
+            self._call(key, function, delta, now)
+
+    # ------------------------
+    def _deadline(self, key):
+        return min(self.last_press[key] + configure.COALESCE_INTERVAL,
+                   self.last_call[key] + configure.COALESCE_MAX_DELAY)
+
+    def _call(self, key, function, delta, now):
+        self.last_call[key] = now
+        function(delta)
+
+
+coalescer = Coalescer()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+import collections
+import concurrent.futures
+import logging
+import os
+import re
+import shlex
+import signal
+import subprocess
+
+from xpywm import configure
+
+# commands including these characters are executed via /bin/sh
+SHELL_META_REGEXP = r'[|&;<>()$`\\*?\[\]#~{}\n]'
+
+
+def _split(command):
+    '''Convert the command string COMMAND into the argument list for
+    subprocess.  /bin/sh is used only when shell syntax is required.'''
+    if re.search(SHELL_META_REGEXP, command):
+        return ['/bin/sh', '-c', command]
+    try:
+        return shlex.split(command)
+    except ValueError:
+        return ['/bin/sh', '-c', command]
+
+
+class CommandExecutor():
+    '''Execute external commands without blocking the event loop.
+
+    launch() starts a command in the background, and run() executes a
+    command in the bounded worker pool and passes its output to the
+    callback.  Callbacks are called from the event loop via dispatch(),
+    which is triggered when fileno() becomes readable.
+
+    '''
+
+    def __init__(self, max_workers=None):
+        self.pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers or configure.EXECUTOR_MAX_WORKERS)
+        self.read_fd, self.write_fd = os.pipe()
+        os.set_blocking(self.read_fd, False)
+        os.set_blocking(self.write_fd, False)
+
+        # completed (command, callback, future) of run()
+        self.completed = collections.deque()
+        # background processes started by launch()
+        self.children = {}
+        # the number of running processes for each command
+        self.running = collections.Counter()
+
+    def fileno(self):
+        return self.read_fd
+
+    def install_sigchld_handler(self):
+        '''Wake up the event loop when a child process exits.'''
+        signal.signal(signal.SIGCHLD, lambda signum, frame: self._wakeup())
+
+    # ------------------------
+    def _acquire(self, command, limit):
+        if limit is None:
+            limit = configure.EXECUTOR_MAX_CONCURRENT
+        if self.running[command] >= limit:
+            logging.warning("skip '%s': %d running", command, self.running[command])
+            return False
+        self.running[command] += 1
+        return True
+
+    def _release(self, command):
+        self.running[command] -= 1
+        if self.running[command] <= 0:
+            del self.running[command]
+
+    def launch(self, command, limit=None):
+        '''Start COMMAND in the background.  The process is reaped by
+        reap() after its termination.  Return the process or None.'''
+        if not self._acquire(command, limit):
+            return None
+        try:
+            proc = subprocess.Popen(_split(command), stdin=subprocess.DEVNULL,
+                                    start_new_session=True)
+        except OSError:
+            logging.exception("unable to launch '%s'", command)
+            self._release(command)
+            return None
+        self.children[proc] = command
+        return proc
+
+    def run(self, command, callback=None, timeout=None, limit=1):
+        '''Execute COMMAND in the worker pool.  CALLBACK is called with the
+        output of COMMAND (trailing newline removed) from the event
+        loop.  At most LIMIT processes of COMMAND run at the same
+        time.'''
+        if not self._acquire(command, limit):
+            return False
+        if timeout is None:
+            timeout = configure.EXECUTOR_TIMEOUT
+        future = self.pool.submit(self._run, command, timeout)
+        future.add_done_callback(
+            lambda future: self._complete(command, callback, future))
+        return True
+
+    def _run(self, command, timeout):
+        proc = subprocess.run(_split(command), stdin=subprocess.DEVNULL,
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                              timeout=timeout)
+        output = proc.stdout.decode(errors='replace')
+        return output[:-1] if output.endswith('\n') else output
+
+    def _complete(self, command, callback, future):
+        # NOTE: called from a worker thread
+        self.completed.append((command, callback, future))
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            os.write(self.write_fd, b'\0')
+        except BlockingIOError:
+            # the event loop has already been woken up
+            pass
+
+    # ------------------------
+    def dispatch(self):
+        '''Call the callbacks of completed commands and reap terminated
+        processes.  Called from the event loop.'''
+        try:
+            while os.read(self.read_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        while self.completed:
+            command, callback, future = self.completed.popleft()
+            self._release(command)
+            try:
+                output = future.result()
+            except subprocess.TimeoutExpired:
+                logging.error("'%s' timed out", command)
+                continue
+            except OSError:
+                logging.exception("unable to run '%s'", command)
+                continue
+            if callback is not None:
+                try:
+                    callback(output)
+                except Exception:
+                    logging.exception("callback of '%s'", command)
+        self.reap()
+
+    def reap(self):
+        for proc, command in list(self.children.items()):
+            if proc.poll() is not None:
+                del self.children[proc]
+                self._release(command)
+
+
+executor = CommandExecutor()
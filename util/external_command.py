@@ -1,65 +1,106 @@
 #!/usr/bin/env python3
 
-import os
 import re
-import subprocess
+import time
+
+from Xlib import X, Xatom
+from Xlib.protocol import request
 
 from xpywm import configure
 from xpywm.util import window_property
+from xpywm.util.executor import executor
+from xpywm.util.mixer import mixer
 
 STOP_CURSOR_CLS = r'rxvt|emacs'
 
 
-def get_mixer_level():
-    '''Return the master playback volume of the default ALSA audio device.
-    Volume ranges between 0 and 100.
+def audio_raise_volume(delta=5):
+    mixer.change_level(delta)
 
-    '''
-    output = subprocess.getoutput('amixer get Master')
-    m = re.search(r'Playback.*\[(\d+)%\]', output)
-    if m:
-        level = int(m.group(1))
-        return level
-    else:
-        return None
 
+def audio_lower_volume(delta=5):
+    audio_raise_volume(-delta)
 
-def set_mixer_level(level):
-    subprocess.getoutput('amixer set Master {}%'.format(level))
 
+def backlight_increase(delta=10):
+    if delta > 0:
+        executor.launch('backlight -inc {}'.format(delta))
+    elif delta < 0:
+        executor.launch('backlight -dec {}'.format(-delta))
 
-def audio_raise_volume(delta=5):
-    level = get_mixer_level()
-    if level is not None:
-        level = max(0, min(level + delta, 100))
-        set_mixer_level(level)
 
-
-def audio_lower_volume(delta=5):
-    audio_raise_volume(-delta)
+def backlight_decrease(delta=10):
+    backlight_increase(-delta)
 
 
 def backlight_toggle(brightness, brightness_other):
-    try:
-        if int(subprocess.getoutput('backlight -get')) == brightness:
-            brightness = brightness_other
-        os.system(f'backlight -set {brightness}')
-    except ValueError:
-        return
+    def callback(output):
+        try:
+            current = int(output)
+        except ValueError:
+            return
+        executor.launch('backlight -set {}'.format(
+            brightness_other if current == brightness else brightness), limit=1)
+
+    executor.run('backlight -get', callback)
 
 
 # called from: pointer.py
 def enable_touchpad(_bool):
-    os.system('synclient TouchpadOff={}'.format(int(not _bool)))
+    executor.launch('synclient TouchpadOff={}'.format(int(not _bool)), limit=1)
 
 
 def screenshot(window_id='root'):
-    os.system(f'import -window {window_id} /tmp/`date +%y%m%d-%H%M%S`.png')
+    executor.launch(f'import -window {window_id} /tmp/`date +%y%m%d-%H%M%S`.png')
+
+
+class Opacity():
+    '''Set the window opacity through _NET_WM_WINDOW_OPACITY.  Whether a
+    compositor is running is checked by the owner of _NET_WM_CM_Sn
+    selection at most every COMPOSITOR_CHECK_INTERVAL seconds, so that a
+    compositor started later is noticed, and whether the opacity is
+    applied is cached for each window class.'''
+
+    COMPOSITOR_CHECK_INTERVAL = 10
+
+    def __init__(self):
+        self.compositor_running = None
+        self.compositor_checked = 0
+        self.class_alpha = {}
+
+    def _is_compositor_running(self, display):
+        now = time.monotonic()
+        if self.compositor_running is None or \
+           now - self.compositor_checked > Opacity.COMPOSITOR_CHECK_INTERVAL:
+            atom = display.get_atom('_NET_WM_CM_S{}'.format(display.default_screen))
+            owner = request.GetSelectionOwner(display=display, selection=atom).owner
+            self.compositor_running = owner != X.NONE
+            self.compositor_checked = now
+        return self.compositor_running
+
+    def _alpha_of(self, window):
+        cls = window_property.get_window_class(window).lower()
+        if cls not in self.class_alpha:
+            if re.search(configure.INTRANSSET_CLS, cls) \
+               or re.search(window_property.BROWSER_WINDOW_REGEXP, cls):
+                self.class_alpha[cls] = None
+            else:
+                self.class_alpha[cls] = int(float(configure.TRANSSET_ALPHA) * 0xffffffff)
+        return self.class_alpha[cls]
+
+    def set(self, window):
+        if not self._is_compositor_running(window.display):
+            return
+        alpha = self._alpha_of(window)
+        if alpha is None:
+            return
+        window.change_property(window.display.get_atom('_NET_WM_WINDOW_OPACITY'),
+                               Xatom.CARDINAL, 32, [alpha])
+
+
+opacity = Opacity()
 
 
 # called from: vscreen.py
 def transset(window):
-    if re.search(configure.INTRANSSET_CLS, window_property.get_window_class(window).lower()) \
-       or window_property.is_browser_window(window):
-        return
-    os.system(f'pidof xcompmgr && transset --id {window.id} {configure.TRANSSET_ALPHA}')
+    opacity.set(window)
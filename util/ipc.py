@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+'''Command socket for scripting the window manager.
+
+A client sends a line of JSON, which is a command or a list of
+commands, and receives a line of JSON, which is the list of replies in
+the same order.  A command is
+
+    {"type": "vscreen", "method": "tile_all_windows", "window": "focused"}
+    {"type": "vscreen_manager", "method": "select_vscreen", "args": [2]}
+
+where TYPE is one of TARGETS, and WINDOW (optional) is a window id or
+"focused" passed as the first argument.  A reply is {"ok": true,
+"result": ...} or {"ok": false, "error": "..."}.
+
+'''
+
+import atexit
+import errno
+import json
+import logging
+import os
+import socket
+import stat
+import time
+
+from xpywm import configure
+from xpywm.util.stats import stats
+from xpywm.util.xtrace import xtrace
+
+TARGETS = ['vscreen', 'vscreen_manager', 'pointer', 'stats']
+
+# the maximum length of a request line
+MAX_REQUEST = 65536
+# the maximum length of replies not yet read by a client
+MAX_PENDING_REPLY = 1 << 20
+
+
+class CommandServer():
+    '''Serve the command socket from the event loop.  The sockets are
+    non-blocking and watched by select() with the X connection, so that a
+    client never blocks the event handling.  Replies which do not fit in
+    the socket buffer are kept and sent when the socket becomes writable.
+    The socket is removed by close(), which is called at exit.
+
+    '''
+
+    def __init__(self, callback, path=None):
+        self.callback = callback
+        self.path = path or configure.IPC_SOCKET
+        # connection -> received bytes
+        self.connections = {}
+        # connection -> replies not yet sent
+        self.outputs = {}
+        self.listener = None
+
+        if _is_serving(self.path):
+            raise OSError(errno.EADDRINUSE, 'served by another process', self.path)
+        if os.path.lexists(self.path):
+            # left by a process which did not exit normally
+            if not stat.S_ISSOCK(os.lstat(self.path).st_mode):
+                raise OSError(errno.EEXIST, 'not a socket', self.path)
+            os.unlink(self.path)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self.listener.listen(8)
+        self.listener.setblocking(False)
+        atexit.register(self.close)
+
+    def readers(self):
+        '''Return the sockets to be watched by select().'''
+        return [self.listener, *self.connections]
+
+    def writers(self):
+        '''Return the sockets with replies to be sent, to be watched by
+        select().'''
+        return list(self.outputs)
+
+    def dispatch(self, readable, writable=()):
+        '''Accept connections and serve requests on the sockets READABLE, and
+        send the pending replies on the sockets WRITABLE.'''
+        for sock in writable:
+            if sock in self.outputs:
+                self._send(sock)
+        for sock in readable:
+            if sock is self.listener:
+                self._accept()
+            elif sock in self.connections:
+                self._receive(sock)
+
+    def close(self):
+        '''Close all connections and remove the socket.'''
+        if self.listener is None:
+            return
+        for conn in list(self.connections):
+            self._close(conn)
+        self.listener.close()
+        self.listener = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    # ------------------------
+    def _accept(self):
+        try:
+            conn, _ = self.listener.accept()
+        except BlockingIOError:
+            return
+        conn.setblocking(False)
+        self.connections[conn] = b''
+
+    def _receive(self, conn):
+        try:
+            data = conn.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._close(conn)
+            return
+        buf = self.connections[conn] + data
+        while b'\n' in buf:
+            line, buf = buf.split(b'\n', 1)
+            if line.strip() and not self._reply(conn, self.execute(line)):
+                return
+        if len(buf) > MAX_REQUEST:
+            logging.error('too long ipc request')
+            self._close(conn)
+            return
+        self.connections[conn] = buf
+
+    def _reply(self, conn, replies):
+        output = self.outputs.get(conn, b'') + json.dumps(replies).encode() + b'\n'
+        if len(output) > MAX_PENDING_REPLY:
+            # the client does not read the replies
+            logging.error('too many pending ipc replies')
+            self._close(conn)
+            return False
+        self.outputs[conn] = output
+        return self._send(conn)
+
+    def _send(self, conn):
+        '''Send the pending replies on the connection CONN as far as the
+        socket buffer allows.  Return False if the connection is closed.'''
+        try:
+            sent = conn.send(self.outputs[conn])
+        except BlockingIOError:
+            return True
+        except OSError:
+            logging.exception('unable to reply to ipc client')
+            self._close(conn)
+            return False
+        output = self.outputs[conn][sent:]
+        if output:
+            self.outputs[conn] = output
+        else:
+            del self.outputs[conn]
+        return True
+
+    def _close(self, conn):
+        self.connections.pop(conn, None)
+        self.outputs.pop(conn, None)
+        conn.close()
+
+    # ------------------------
+    def execute(self, line):
+        '''Execute the commands in the request LINE and return the list of
+        replies.'''
+        try:
+            commands = json.loads(line)
+        except ValueError as e:
+            return [{'ok': False, 'error': 'invalid json: {}'.format(e)}]
+        if isinstance(commands, dict):
+            commands = [commands]
+        if not isinstance(commands, list):
+            return [{'ok': False, 'error': 'command must be an object or a list'}]
+        replies = []
+        for command in commands:
+            # a bad command never stops the window manager
+            try:
+                replies.append(self._execute(command))
+            except Exception as e:
+                logging.exception('ipc command %s', command)
+                replies.append({'ok': False, 'error': '{}: {}'.format(type(e).__name__, e)})
+        return replies
+
+    def _execute(self, command):
+        try:
+            type_, name = command['type'], command['method']
+        except (TypeError, KeyError):
+            return {'ok': False, 'error': 'type and method are required'}
+        if type_ not in TARGETS:
+            return {'ok': False, 'error': 'unknown type {}'.format(type_)}
+        if not isinstance(name, str) or name.startswith('_'):
+            return {'ok': False, 'error': 'unknown method {}.{}'.format(type_, name)}
+        method = getattr(self.callback.target(type_), name, None)
+        if not callable(method):
+            return {'ok': False, 'error': 'unknown method {}.{}'.format(type_, name)}
+        args = command.get('args', [])
+        if not isinstance(args, list):
+            args = [args]
+        if command.get('window') == 'focused':
+            # None if no window, as for key bindings
+            args = [self.callback.vscreen_manager.current_vscreen.current_focused_window, *args]
+        elif 'window' in command:
+            window = self._window(command['window'])
+            if window is None:
+                return {'ok': False, 'error': 'no window {}'.format(command['window'])}
+            args = [window, *args]
+
+        key = 'ipc.{}.{}'.format(type_, name)
+        start = time.perf_counter()
+        previous = xtrace.enter(key)
+        try:
+            result = method(*args)
+        except Exception as e:
+            logging.exception('ipc command %s', command)
+            return {'ok': False, 'error': '{}: {}'.format(type(e).__name__, e)}
+        finally:
+            xtrace.leave(previous)
+            stats.record(key, time.perf_counter() - start)
+        return {'ok': True, 'result': _jsonable(result)}
+
+    def _window(self, window_id):
+        for window in self.callback.vscreen_manager.registry.vscreen_numbers:
+            if window.id == window_id:
+                return window
+        return None
+
+
+def _jsonable(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, dict):
+        return {str(key): _jsonable(val) for key, val in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [_jsonable(val) for val in value]
+    if hasattr(value, 'id'):
+        # X resources
+        return value.id
+    return repr(value)
+
+
+def _is_serving(path):
+    '''Return True if some process accepts connections on the socket
+    PATH.'''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            return False
+    return True
+
+
+def send(commands, path=None, timeout=5):
+    '''Send COMMANDS to the running window manager and return the list of
+    replies.'''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path or configure.IPC_SOCKET)
+        sock.sendall(json.dumps(commands).encode() + b'\n')
+        buf = b''
+        while not buf.endswith(b'\n'):
+            data = sock.recv(65536)
+            if not data:
+                break
+            buf += data
+    return json.loads(buf)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+import logging
+import re
+import subprocess
+import time
+
+from xpywm import configure
+from xpywm.util.executor import executor
+
+try:
+    import alsaaudio
+except ImportError:
+    alsaaudio = None
+
+
+def parse_mixer_level(output):
+    '''Return the playback volume in the output of `amixer get'.  Volume
+    ranges between 0 and 100.
+
+    '''
+    m = re.search(r'Playback.*\[(\d+)%\]', output)
+    if m:
+        level = int(m.group(1))
+        return level
+    else:
+        return None
+
+
+class AlsaBackend():
+    '''Access the mixer control directly with pyalsaaudio.'''
+
+    def __init__(self, control):
+        self.mixer = alsaaudio.Mixer(control)
+
+    def get_level(self, callback):
+        callback(self.mixer.getvolume()[0])
+
+    def set_level(self, level):
+        self.mixer.setvolume(level)
+
+
+class AmixerBackend():
+    '''Keep a long-lived `amixer -s' co-process and write a single `sset'
+    command to its stdin for each level change.'''
+
+    def __init__(self, control):
+        self.control = control
+        self.proc = None
+
+    def _coprocess(self):
+        if self.proc is None or self.proc.poll() is not None:
+            self.proc = subprocess.Popen(['amixer', '-q', '-s'], stdin=subprocess.PIPE,
+                                         stdout=subprocess.DEVNULL,
+                                         stderr=subprocess.DEVNULL)
+        return self.proc
+
+    def get_level(self, callback):
+        executor.run(f'amixer get {self.control}',
+                     lambda output: callback(parse_mixer_level(output)))
+
+    def set_level(self, level):
+        line = f'sset {self.control} {level}%\n'.encode()
+        for _ in range(2):
+            try:
+                proc = self._coprocess()
+                proc.stdin.write(line)
+                proc.stdin.flush()
+                return
+            except BrokenPipeError:
+                # amixer exited; restart it
+                self.proc = None
+            except OSError:
+                logging.exception('unable to run amixer')
+                return
+
+
+class Mixer():
+    '''Cache the current mixer level and update it with a single write per
+    change.  The cached level is re-read after MIXER_CACHE_TTL seconds
+    since the level might be changed by other programs; changes made
+    while the level is being read are added up and applied when the read
+    finishes.'''
+
+    def __init__(self, control=None):
+        control = control or configure.MIXER_CONTROL
+        self.backend = None
+        if alsaaudio is not None:
+            try:
+                self.backend = AlsaBackend(control)
+            except alsaaudio.ALSAAudioError:
+                logging.exception('fall back to amixer')
+        if self.backend is None:
+            self.backend = AmixerBackend(control)
+
+        self.level = None
+        self.level_time = 0
+        # the sum of changes waiting for the level being read, or None
+        self.pending_delta = None
+        self.read_time = 0
+
+    def _is_stale(self):
+        ttl = configure.MIXER_CACHE_TTL
+        return self.level is None \
+            or (ttl is not None and time.monotonic() - self.level_time > ttl)
+
+    def change_level(self, delta):
+        if not self._is_stale():
+            self.set_level(self.level + delta)
+            return
+
+        # a read which has not finished in EXECUTOR_TIMEOUT has failed
+        if self.pending_delta is not None and \
+           time.monotonic() - self.read_time <= configure.EXECUTOR_TIMEOUT:
+            self.pending_delta += delta
+            return
+        self.pending_delta = delta
+        self.read_time = time.monotonic()
+
+        def callback(level):
+            delta, self.pending_delta = self.pending_delta, None
+            if level is not None and delta is not None:
+                self.set_level(level + delta)
+
+        self.backend.get_level(callback)
+
+    def set_level(self, level):
+        self.level = max(0, min(level, 100))
+        self.level_time = time.monotonic()
+        self.backend.set_level(self.level)
+
+
+mixer = Mixer()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+
+from Xlib import X
+
+# name of the root window property holding the state across restart
+STATE_PROPERTY = '_XPYWM_STATE'
+
+
+def save(display, screen, state):
+    '''Store the window manager state STATE (JSON-serializable) in the root
+    window property, and wait until the X server processes it.'''
+    root = screen.root
+    data = json.dumps(state, separators=(',', ':')).encode()
+    root.change_property(display.get_atom(STATE_PROPERTY), display.get_atom('UTF8_STRING'),
+                         8, data)
+    display.sync()
+    logging.info('saved state (%d bytes)', len(data))
+
+
+def load(display, screen):
+    '''Return the state stored by save() and delete the property.  Return
+    None if no state is stored.'''
+    root = screen.root
+    prop = root.get_full_property(display.get_atom(STATE_PROPERTY), X.AnyPropertyType)
+    if prop is None:
+        return None
+    root.delete_property(display.get_atom(STATE_PROPERTY))
+    try:
+        return json.loads(bytes(prop.value).decode())
+    except ValueError:
+        logging.exception('invalid state')
+        return None
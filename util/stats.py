@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import collections
+import logging
+import signal
+import time
+
+from xpywm import configure
+
+
+class Histogram():
+    '''Histogram with power-of-two buckets.  Values are recorded in
+    integer UNIT (e.g. microseconds for latencies).'''
+
+    def __init__(self):
+        self.buckets = collections.Counter()
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        value = int(value)
+        self.buckets[value.bit_length()] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        '''Return the upper bound of the bucket containing the P-th
+        percentile.'''
+        threshold = self.count * p / 100
+        n = 0
+        for bits in sorted(self.buckets):
+            n += self.buckets[bits]
+            if n >= threshold:
+                return (1 << bits) - 1
+        return 0
+
+    def summary(self):
+        mean = self.total / self.count if self.count else 0
+        return 'n={} mean={:.0f} p50<={} p99<={} max={}'.format(
+            self.count, mean, self.percentile(50), self.percentile(99), self.max)
+
+
+class Stats():
+    '''Always-on counters and histograms of the event loop.  Latencies are
+    recorded in microseconds.'''
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.latencies = collections.defaultdict(Histogram)
+        self.values = collections.defaultdict(Histogram)
+        # (local time - X server time) [ms], used to estimate the delay
+        # since an event was generated
+        self.time_offset = None
+        # additional reporters, called with a list of lines to extend
+        self.reporters = []
+
+    # ------------------------
+    def record(self, key, seconds):
+        self.latencies[key].add(seconds * 1e6)
+
+    def observe(self, key, value):
+        self.values[key].add(value)
+
+    def observe_event_time(self, event_time):
+        '''Record the estimated delay [ms] since the X server generated an
+        event with timestamp EVENT_TIME.'''
+        offset = time.monotonic() * 1000 - event_time
+        if self.time_offset is None or offset < self.time_offset \
+           or offset - self.time_offset > 60000:
+            # the first event, or the server time is wrapped around
+            self.time_offset = offset
+        self.values['time_since_event_ms'].add(offset - self.time_offset)
+
+    # ------------------------
+    def report(self):
+        lines = ['# uptime {:.0f}s'.format(time.time() - self.start_time),
+                 '# latency [us]']
+        for key in sorted(self.latencies, key=lambda k: -self.latencies[k].total):
+            lines.append('{}\t{}'.format(key, self.latencies[key].summary()))
+        lines.append('# values')
+        for key in sorted(self.values):
+            lines.append('{}\t{}'.format(key, self.values[key].summary()))
+        for reporter in self.reporters:
+            reporter(lines)
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path=None):
+        path = path or configure.STATS_FILE
+        try:
+            with open(path, 'w') as f:
+                f.write(self.report())
+        except OSError:
+            logging.exception('unable to write %s', path)
+            return
+        logging.info('stats dumped to %s', path)
+
+    def install_signal_handler(self):
+        '''Dump stats on SIGUSR1.'''
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.dump())
+
+
+stats = Stats()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+import collections
+import contextlib
+import logging
+
+import Xlib
+from Xlib import X
+from Xlib.protocol import event, request
+
+from xpywm import configure as config
+
+Geometry = collections.namedtuple('Geometry', ['x', 'y', 'width', 'height', 'border_width'])
+
+GEOMETRY_KEYS = ('x', 'y', 'width', 'height', 'border_width')
+
+
+class GeometryModel():
+    '''In-memory geometry of windows.  The geometry of a window is
+    fetched from the X server only once, and then kept current from the
+    configure requests of the window manager itself and from
+    ConfigureNotify events.
+
+    If configure.GEOMETRY_CROSSCHECK is set, every lookup is compared
+    with the geometry on the X server and a mismatch is logged.
+
+    Inside batch(), configure requests are collected and sent at once at
+    the end of the block, only for windows whose geometry changes.
+
+    A client window reparented into a frame (configure.FRAME_MODE =
+    'reparent') is seen at the position of its content on the frame's
+    parent, and moving it configures its frame only.
+
+    '''
+
+    def __init__(self):
+        self.geometries = {}
+        # client window -> frame window
+        self.frames = {}
+        # window -> configure keys, while in batch()
+        self.pending = None
+
+    # ------------------------
+    def get(self, window):
+        '''Return the geometry of the window WINDOW.  Raise
+        Xlib.error.BadWindow or Xlib.error.BadDrawable for invalid window
+        like window.get_geometry().'''
+        geom = self._get(window)
+        frame = self.frames.get(window, None)
+        if frame is not None:
+            geom = self._framed(geom, self._get(frame))
+        if self.pending and window in self.pending:
+            # the geometry after the batch is applied
+            geom = geom._replace(**{key: value for key, value in self.pending[window].items()
+                                    if key in GEOMETRY_KEYS})
+        return geom
+
+    def prefetch(self, windows):
+        '''Fetch the geometries of WINDOWS, which are not in the model, in a
+        single pipelined batch.  Invalid windows are ignored.'''
+        requests = [(window, request.GetGeometry(display=window.display, defer=True,
+                                                 drawable=window.id))
+                    for window in windows if window not in self.geometries]
+        for window, reply in requests:
+            try:
+                reply.reply()
+            except (Xlib.error.BadWindow, Xlib.error.BadDrawable):
+                continue
+            self.geometries[window] = Geometry(reply.x, reply.y, reply.width, reply.height,
+                                               reply.border_width)
+
+    def is_known(self, window):
+        return window in self.geometries
+
+    def peek(self, window):
+        '''Return the geometry of the window WINDOW in the model, or None if
+        unknown.  Nothing is requested to the X server.'''
+        geom = self.geometries.get(window, None)
+        frame = self.frames.get(window, None)
+        if geom is None or frame is None:
+            return geom
+        frame_geom = self.geometries.get(frame, None)
+        return self._framed(geom, frame_geom) if frame_geom is not None else None
+
+    def add_frame(self, window, frame, frame_geom):
+        '''Register the frame FRAME, whose geometry is FRAME_GEOM, of the
+        client window WINDOW reparented at (0, 0) without border.'''
+        geom = self.get(window)
+        self.frames[window] = frame
+        self.geometries[frame] = frame_geom
+        self.geometries[window] = Geometry(0, 0, geom.width, geom.height, 0)
+
+    def remove_frame(self, window):
+        '''Forget the frame of the window WINDOW reparented out of it.  The
+        window is at the position of the content of the frame.'''
+        geom = self.peek(window)
+        frame = self.frames.pop(window, None)
+        self.geometries.pop(frame, None)
+        if geom is not None:
+            self.geometries[window] = geom
+
+    def configure(self, window, **keys):
+        '''Configure the window WINDOW and reflect the new geometry to the
+        model.  Inside batch(), the request is deferred until the end of
+        the batch.'''
+        if self.pending is not None:
+            self.pending.setdefault(window, {}).update(keys)
+            return
+        self._send(window, keys)
+
+    @contextlib.contextmanager
+    def batch(self):
+        '''Collect the configure requests in the block, and send them at
+        the end of the block in a single flush.  Only the changed values
+        of the windows whose geometry changes are sent.  If
+        configure.CONFIGURE_GRAB_SERVER is set, the requests are sent
+        inside a server grab, so that all windows are updated at once.
+        Nested batches are merged into the outermost one.'''
+        if self.pending is not None:
+            yield
+            return
+        self.pending = collections.OrderedDict()
+        try:
+            yield
+        finally:
+            pending, self.pending = self.pending, None
+            self._apply(pending)
+
+    def update(self, window, **keys):
+        geom = self.geometries.get(window, None)
+        if geom is None:
+            return
+        changes = {key: keys[key] for key in GEOMETRY_KEYS if key in keys}
+        if changes:
+            self.geometries[window] = geom._replace(**changes)
+
+    def update_from_event(self, event):
+        '''Reflect ConfigureNotify event EVENT to the model.'''
+        self.geometries[event.window] = Geometry(event.x, event.y,
+                                                 event.width, event.height,
+                                                 event.border_width)
+
+    def forget(self, window):
+        self.geometries.pop(window, None)
+        self.geometries.pop(self.frames.pop(window, None), None)
+
+    # ------------------------
+    def _get(self, window):
+        geom = self.geometries.get(window, None)
+        if geom is None:
+            geom = self._fetch(window)
+        elif config.GEOMETRY_CROSSCHECK:
+            self._crosscheck(window, geom)
+            geom = self.geometries[window]
+        return geom
+
+    @staticmethod
+    def _framed(geom, frame_geom):
+        return geom._replace(x=frame_geom.x + frame_geom.border_width,
+                             y=frame_geom.y + frame_geom.border_width)
+
+    def _send(self, window, keys):
+        frame = self.frames.get(window, None)
+        if frame is None:
+            window.configure(**keys)
+            self.update(window, **keys)
+            return
+        # move the frame, and resize both the frame and the window
+        border_width = self.geometries[frame].border_width
+        frame_keys = {key: value for key, value in keys.items() if key != 'border_width'}
+        for key in ['x', 'y']:
+            if key in keys:
+                frame_keys[key] = keys[key] - border_width
+        window_keys = {key: keys[key] for key in ['width', 'height'] if key in keys}
+        frame.configure(**frame_keys)
+        self.update(frame, **frame_keys)
+        if window_keys:
+            window.configure(**window_keys)
+            self.update(window, **window_keys)
+        elif 'x' in keys or 'y' in keys:
+            self._notify_moved(window)
+
+    def _notify_moved(self, window):
+        '''Send a synthetic ConfigureNotify to the client of the window
+        WINDOW moved with its frame, as required by ICCCM.'''
+        geom = self.peek(window)
+        if geom is None:
+            return
+        notify = event.ConfigureNotify(window=window.id, event=window.id,
+                                       above_sibling=X.NONE, x=geom.x, y=geom.y,
+                                       width=geom.width, height=geom.height,
+                                       border_width=0, override=False)
+        window.send_event(notify, event_mask=X.StructureNotifyMask)
+
+    def _diff(self, window, keys):
+        geom = self.peek(window)
+        if geom is None:
+            return keys
+        return {key: value for key, value in keys.items()
+                if key not in GEOMETRY_KEYS or getattr(geom, key) != value}
+
+    def _apply(self, pending):
+        if not pending:
+            return
+        self.prefetch(list(pending) + [self.frames[window] for window in pending
+                                       if window in self.frames])
+        changes = [(window, keys) for window, keys in
+                   ((window, self._diff(window, keys)) for window, keys in pending.items())
+                   if keys]
+        if not changes:
+            return
+        display = changes[0][0].display
+        grab = config.CONFIGURE_GRAB_SERVER and len(changes) > 1
+        if grab:
+            request.GrabServer(display=display)
+        try:
+            for window, keys in changes:
+                self._send(window, keys)
+        finally:
+            if grab:
+                request.UngrabServer(display=display)
+            display.flush()
+
+    def _fetch(self, window):
+        reply = window.get_geometry()
+        geom = Geometry(reply.x, reply.y, reply.width, reply.height, reply.border_width)
+        self.geometries[window] = geom
+        return geom
+
+    def _crosscheck(self, window, geom):
+        try:
+            actual = self._fetch(window)
+        except Exception:
+            logging.exception('crosscheck 0x%x', window.id)
+            return
+        if actual != geom:
+            logging.warning('geometry mismatch 0x%x model %s server %s',
+                            window.id, geom, actual)
+
+
+model = GeometryModel()
+
+
+def get_geometry(window):
+    return model.get(window)
+
+
+def configure(window, **keys):
+    model.configure(window, **keys)
+
+
+def batch():
+    return model.batch()
+
+
+def toplevel(window):
+    '''Return the frame of the window WINDOW if reparented into a frame,
+    which is mapped, unmapped and restacked instead of WINDOW.'''
+    return model.frames.get(window, window)
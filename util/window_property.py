@@ -2,26 +2,167 @@
 
 import logging
 import re
-import subprocess
 
 import Xlib
+from Xlib import X, Xatom
+from Xlib.protocol import request
+from Xlib.xobject import drawable
 
 MOVIE_WINDOW_REGEXP = r'mplayer|ニコニコ動画|ニコニコ生放送|youtube|twitch|abema|openrec|prime|動画再生|(apple music)'
 BROWSER_WINDOW_REGEXP = r'chromium|chrome|firefox|vivaldi'
+# the maximum length of the window title in 32-bit units
+NAME_LENGTH = 1024
+# _NET_WM_WINDOW_TYPE of windows not to be tiled
+DIALOG_WINDOW_TYPES = ('_NET_WM_WINDOW_TYPE_DIALOG', '_NET_WM_WINDOW_TYPE_SPLASH')
 
 
-def get_window_class(window):
-    '''Fetch the WM_CLASS window property of the window WINDOW and return
-    the class part of the property.  Return empty string if class is not
-    retrieved.
+class WindowPropertyCache():
+    '''Per-window cache of the window properties which are frequently
+    referred (class, instance, title, transient-for, window type and
+    PID).  The properties of a window are fetched once when the window
+    is registered, invalidated by PropertyNotify events and evicted by
+    DestroyNotify events.
 
     '''
+
+    KEYS = ('class', 'instance', 'name', 'transient_for', 'window_type', 'pid')
+    # properties fetched together
+    GROUPS = {'class': 'class', 'instance': 'class', 'name': 'name',
+              'transient_for': 'transient_for', 'window_type': 'window_type',
+              'pid': 'pid'}
+    DEFAULTS = {'class': '', 'instance': '', 'name': '',
+                'transient_for': None, 'window_type': (), 'pid': None}
+
+    def __init__(self):
+        self.properties = {}
+        self.hits = 0
+        self.misses = 0
+
+    # ------------------------
+    def get(self, window, key):
+        props = self.properties.get(window, None)
+        if props is not None and key in props:
+            self.hits += 1
+            return props[key]
+        self.prefetch([window], keys=(key, ))
+        return self.properties[window][key]
+
+    def prefetch(self, windows, keys=KEYS):
+        '''Fetch the properties KEYS of WINDOWS, which are not cached, in a
+        single pipelined batch: all requests are sent first, and then
+        the replies are collected.'''
+        groups = sorted({self.GROUPS[key] for key in keys})
+        requests = []
+        for window in windows:
+            props = self.properties.setdefault(window, {})
+            for group in groups:
+                if group not in props:
+                    self.misses += 1
+                    requests.append((window, group, _request_group(window, group)))
+        for window, group, group_requests in requests:
+            self.properties[window].update(_reply_group(window, group, group_requests))
+
+    def prefetch_names(self, windows):
+        '''Fetch the titles of WINDOWS, which are not cached, in a single
+        pipelined batch.'''
+        self.prefetch(windows, keys=('name', ))
+
+    def register(self, window):
+        '''Fetch all cached properties of the window WINDOW.'''
+        self.prefetch([window])
+
+    def update(self, window, atom):
+        '''Invalidate the properties of the window WINDOW corresponding to
+        the property ATOM.  Called on PropertyNotify events.'''
+        props = self.properties.get(window, None)
+        if not props:
+            return
+        for key in self._atom_keys(window, atom):
+            props.pop(key, None)
+
+    def evict(self, window):
+        self.properties.pop(window, None)
+
+    def report(self, lines):
+        '''Extend LINES with the statistics of the cache.'''
+        lines.append('# property cache: windows hits misses')
+        lines.append('{}\t{}\t{}'.format(len(self.properties), self.hits, self.misses))
+
+    # ------------------------
+    def _atom_keys(self, window, atom):
+        if atom == Xatom.WM_CLASS:
+            return ('class', 'instance')
+        elif atom in (Xatom.WM_NAME, window.display.get_atom('_NET_WM_NAME')):
+            return ('name', )
+        elif atom == Xatom.WM_TRANSIENT_FOR:
+            return ('transient_for', )
+        elif atom == window.display.get_atom('_NET_WM_WINDOW_TYPE'):
+            return ('window_type', )
+        elif atom == window.display.get_atom('_NET_WM_PID'):
+            return ('pid', )
+        return ()
+
+
+def _request_property(window, atom, type_, length=NAME_LENGTH):
+    '''Send GetProperty request without waiting for the reply.'''
+    return request.GetProperty(display=window.display, defer=True,
+                               delete=False, window=window.id,
+                               property=atom, type=type_,
+                               long_offset=0, long_length=length)
+
+
+def _request_group(window, group):
+    display = window.display
+    if group == 'class':
+        return (_request_property(window, Xatom.WM_CLASS, Xatom.STRING), )
+    elif group == 'name':
+        return _request_window_name(window)
+    elif group == 'transient_for':
+        return (_request_property(window, Xatom.WM_TRANSIENT_FOR, Xatom.WINDOW, 1), )
+    elif group == 'window_type':
+        return (_request_property(window, display.get_atom('_NET_WM_WINDOW_TYPE'),
+                                  Xatom.ATOM, 16), )
+    elif group == 'pid':
+        return (_request_property(window, display.get_atom('_NET_WM_PID'), Xatom.CARDINAL, 1), )
+
+
+def _reply_group(window, group, requests):
+    '''Return the properties of GROUP from the replies of REQUESTS.'''
+    if group == 'name':
+        return {'name': _reply_window_name(*requests)}
+    reply, = requests
     try:
-        cmd, cls = window.get_wm_class()
-    # TODO: should explicit exception
-    except Exception:
-        return ''
-    return cls if cls is not None else ''
+        reply.reply()
+        if group == 'class':
+            instance, cls = '', ''
+            if reply.format == 8 and reply.value:
+                parts = reply.value.decode('latin-1').split('\0')
+                instance, cls = (parts + [''])[:2]
+            return {'class': cls, 'instance': instance}
+        if reply.format != 32 or not reply.value:
+            raise ValueError
+        if group == 'transient_for':
+            cls = window.display.get_resource_class('window', drawable.Window)
+            return {'transient_for': cls(window.display, reply.value[0])}
+        elif group == 'window_type':
+            return {'window_type': tuple(reply.value)}
+        elif group == 'pid':
+            return {'pid': reply.value[0]}
+    except (Xlib.error.XError, ValueError):
+        pass
+    return {key: value for key, value in WindowPropertyCache.DEFAULTS.items()
+            if WindowPropertyCache.GROUPS[key] == group}
+
+
+cache = WindowPropertyCache()
+
+
+def get_window_class(window):
+    '''Return the class part of the WM_CLASS window property of the
+    window WINDOW.  Return empty string if class is not retrieved.
+
+    '''
+    return cache.get(window, 'class')
 
 
 def window_shortname(window):
@@ -30,10 +171,42 @@ def window_shortname(window):
 
 
 def get_window_name(window):
-    output = subprocess.getoutput('xwininfo -id 0x{:x}'.format(window.id))
-    m = re.search(r'0x{:x} \"(.+)\"'.format(window.id), output)
-    name = m.group(1) if m else ''
-    return name
+    return cache.get(window, 'name')
+
+
+def _request_window_name(window):
+    '''Send GetProperty requests of _NET_WM_NAME and WM_NAME of the window
+    WINDOW without waiting for the replies.'''
+    display = window.display
+    return (_request_property(window, display.get_atom('_NET_WM_NAME'),
+                              display.get_atom('UTF8_STRING')),
+            _request_property(window, Xatom.WM_NAME, X.AnyPropertyType))
+
+
+def _reply_window_name(net_wm_name, wm_name):
+    '''Return the window title from the replies of _NET_WM_NAME (UTF-8)
+    with a fallback to WM_NAME.'''
+    try:
+        net_wm_name.reply()
+        wm_name.reply()
+        if net_wm_name.format == 8 and net_wm_name.value:
+            return net_wm_name.value.decode('utf-8', 'replace')
+        if wm_name.format == 8 and wm_name.value:
+            encoding = 'latin-1' if wm_name.property_type == Xatom.STRING else 'utf-8'
+            return wm_name.value.decode(encoding, 'replace')
+    except Xlib.error.XError:
+        pass
+    return ''
+
+
+def is_dialog_window(window):
+    '''Check if the window WINDOW is a transient or a dialog-like window,
+    which is not to be tiled.'''
+    if cache.get(window, 'transient_for') is not None:
+        return True
+    window_types = cache.get(window, 'window_type')
+    return any(window.display.get_atom(name) in window_types
+               for name in DIALOG_WINDOW_TYPES)
 
 
 def is_terminal_window(window):
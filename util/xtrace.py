@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import collections
+import time
+
+# the number of worst offenders in the report
+REPORT_TOP = 20
+
+
+class XTrace():
+    '''Opt-in accounting of X requests, blocking round trips and bytes,
+    attributed to the code path (event handler or window manager method)
+    which is running.  Enabled by install(), which wraps the request
+    functions of the display connection.
+
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.context = 'idle'
+        # context -> [requests, round trips, bytes, round trip seconds]
+        self.totals = collections.defaultdict(lambda: [0, 0, 0, 0.])
+        # (context, request name) -> round trips
+        self.round_trips = collections.Counter()
+        # serial -> request name of requests waiting for the reply
+        self.pending = {}
+
+    # ------------------------
+    def enter(self, context):
+        '''Attribute the following requests to CONTEXT.  Return the previous
+        context to be passed to leave().'''
+        previous, self.context = self.context, context
+        return previous
+
+    def leave(self, previous):
+        self.context = previous
+
+    # ------------------------
+    def install(self, display):
+        '''Wrap the request functions of the display DISPLAY.'''
+        conn = display.display
+        send_request = conn.send_request
+        send_and_recv = conn.send_and_recv
+
+        def traced_send_request(request, wait_for_response):
+            send_request(request, wait_for_response)
+            totals = self.totals[self.context]
+            totals[0] += 1
+            totals[2] += len(request._binary)
+            if wait_for_response:
+                self.pending[request._serial] = type(request).__name__
+
+        def traced_send_and_recv(*args, **kargs):
+            serial = kargs.get('request', None)
+            if serial is None:
+                return send_and_recv(*args, **kargs)
+            # block until the reply of the request SERIAL
+            start = time.perf_counter()
+            try:
+                return send_and_recv(*args, **kargs)
+            finally:
+                totals = self.totals[self.context]
+                totals[1] += 1
+                totals[3] += time.perf_counter() - start
+                name = self.pending.pop(serial, '?')
+                self.round_trips[self.context, name] += 1
+                if len(self.pending) > 4096:
+                    # replies received without blocking are not popped
+                    self.pending.clear()
+
+        conn.send_request = traced_send_request
+        conn.send_and_recv = traced_send_and_recv
+        self.enabled = True
+
+    # ------------------------
+    def report(self, lines):
+        '''Extend LINES with the report of the worst offenders.'''
+        if not self.enabled:
+            return
+        lines.append('# X requests: context requests round_trips bytes round_trip_ms')
+        worst = sorted(self.totals.items(), key=lambda item: (-item[1][1], -item[1][0]))
+        for context, (requests, round_trips, nbytes, seconds) in worst[:REPORT_TOP]:
+            lines.append('{}\t{}\t{}\t{}\t{:.1f}'.format(context, requests, round_trips,
+                                                         nbytes, seconds * 1000))
+        lines.append('# X round trips: context request count')
+        for (context, name), count in self.round_trips.most_common(REPORT_TOP):
+            lines.append('{}\t{}\t{}'.format(context, name, count))
+
+
+xtrace = XTrace()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+'''Tiling layouts.  A layout is a function which receives the number of
+windows N and returns N cells (px, py, pwidth, pheight) relative to the
+screen, in linear time.  The window placed at the last cell is the most
+important one (e.g. Emacs), and gets the largest or the top-left area.
+
+'''
+
+import functools
+import math
+
+from xpywm import configure
+
+
+def grid(n):
+    '''Place windows in a grid of ceil(sqrt(N)) columns, from the
+    bottom-right to the top-left column by column.  The last window is
+    stretched to fill the remaining area of its column.'''
+    if n == 0:
+        return []
+    ncols = math.ceil(math.sqrt(n))
+    nrows = math.ceil(n / ncols)
+    width, height = 1 / ncols, 1 / nrows
+    cells = []
+    for i in range(n):
+        col = ncols - 1 - i // nrows
+        row = nrows - 1 - i % nrows
+        if i == n - 1:
+            # the last window is stretched to fill the remaining area
+            cells.append((width * col, 0, width, height * (row + 1)))
+        else:
+            cells.append((width * col, height * row, width, height))
+    return cells
+
+
+def master_stack(n):
+    '''Place the last window in the left half (master), and stack the
+    others in the right half.'''
+    if n <= 1:
+        return [(0, 0, 1, 1)] * n
+    nstack = n - 1
+    height = 1 / nstack
+    cells = [(.5, height * i, .5, height) for i in range(nstack)]
+    cells.append((0, 0, .5, 1))
+    return cells
+
+
+def spiral(n):
+    '''Split the remaining area alternately in vertical and horizontal
+    halves (binary space partitioning).  The last window gets the first
+    half.'''
+    cells = [None] * n
+    x, y, width, height = 0, 0, 1, 1
+    for k in range(n):
+        i = n - 1 - k
+        if k == n - 1:
+            cells[i] = (x, y, width, height)
+        elif k % 2 == 0:
+            cells[i] = (x, y, width / 2, height)
+            x, width = x + width / 2, width / 2
+        else:
+            cells[i] = (x, y, width, height / 2)
+            y, height = y + height / 2, height / 2
+    return cells
+
+
+LAYOUTS = {
+    'grid': grid,
+    'master_stack': master_stack,
+    'spiral': spiral,
+}
+
+
+@functools.lru_cache(maxsize=256)
+def geometries(layout, n, usable_geometry, frame_width):
+    '''Return the absolute geometries (x, y, width, height) of N windows
+    in the layout LAYOUT on the usable area USABLE_GEOMETRY (x, y,
+    width, height) of an output.  Memoized for each (layout, window
+    count, monitor layout).'''
+    ux, uy, uwidth, uheight = usable_geometry
+    return tuple((ux + frame_width + int(uwidth * px),
+                  uy + frame_width + int(uheight * py),
+                  int(uwidth * pwidth), int(uheight * pheight))
+                 for px, py, pwidth, pheight in LAYOUTS[layout](n))
+
+
+def get_geometries(layout, n, usable_geometry):
+    if layout not in LAYOUTS:
+        layout = 'grid'
+    return geometries(layout, n, tuple(usable_geometry), configure.FRAME_WIDTH)
@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
 
+import collections
+import itertools
 import logging
 
 import Xlib
 from Xlib import X
 
-from xpywm.util import external_command, window_property
+from xpywm.util import external_command, window_geometry, window_property
 
 
 class VScreenBase():
@@ -23,13 +25,20 @@ class VScreen(VScreenBase):
 
     '''
 
-    def __init__(self, vscreen_number, frame_window, pointer):
+    def __init__(self, vscreen_number, frame_window, pointer, registry=None,
+                 container_window=None):
         self.vscreen_number = vscreen_number
         self.frame_window = frame_window
         self.pointer = pointer
+        self.registry = registry if registry is not None else WindowRegistry()
+        # the window holding all windows of the vscreen, if enabled
+        self.container_window = container_window
+        self.container = None
+        if container_window is not None:
+            self.container = container_window.create(vscreen_number)
 
         # windows in managed_windows is sorted by recently focused on
-        self.managed_windows = WindowList()
+        self.managed_windows = WindowList(self.registry, vscreen_number)
 
     # ------------------------
     def is_managed(self,
@@ -38,9 +47,7 @@ class VScreen(VScreenBase):
         if window is not None:
             return window in self.managed_windows
         elif window_class is not None:
-            for window in self.managed_windows:
-                if window_class in window_property.get_window_class(window).lower():
-                    return window
+            return self.registry.find_class_window(window_class, self.vscreen_number) or False
         return False
 
     @property
@@ -49,8 +56,11 @@ class VScreen(VScreenBase):
 
     # ------------------------
     def open(self):
-        for window in self.managed_windows:
-            window.map()
+        if self.container is not None:
+            self.container.map()
+        else:
+            for window in self.managed_windows:
+                window_geometry.toplevel(window).map()
 
         if self.managed_windows:
             self.pointer.move_to(self.current_focused_window)
@@ -58,17 +68,24 @@ class VScreen(VScreenBase):
             self.pointer.move(self.pointer.default_geometry)
 
     def close(self):
+        if self.container is not None:
+            # the clients get no UnmapNotify, which clears the frame
+            self.frame_window.clear_frame_window(self.current_focused_window)
+            self.container.unmap()
+            return
         for window in self.managed_windows:
-            window.unmap()
+            window_geometry.toplevel(window).unmap()
 
     # ------------------------ basic operation
-    def manage_window(self, window):
+    def manage_window(self, window, attrs=None):
         '''The window WINDOW is put under the control of the window manager.
         The window is forced to be mapped on the current virtual screen.  The
-        geometry of the window is unchnaged.'''
+        geometry of the window is unchnaged.  ATTRS is the window attributes
+        if already fetched.'''
         # skip if the window seems invalid
         try:
-            attrs = window.get_attributes()
+            if attrs is None:
+                attrs = window.get_attributes()
         except Xlib.error.BadWindow:
             return False
         # skip if the window should not be managed by window manager
@@ -76,9 +93,18 @@ class VScreen(VScreenBase):
         if attrs.override_redirect or self.is_managed(window):
             return False
         self.managed_windows.append(window)
+        mapped = attrs.map_state != X.IsUnmapped
+        toplevel = self.frame_window.attach(window, mapped)
+        framed = toplevel is not window
+        if self.container is not None:
+            self.container_window.adopt(toplevel, self.container, mapped and not framed,
+                                        save_set=not framed)
         window.map()
-        mask = X.EnterWindowMask | X.LeaveWindowMask
+        if framed:
+            toplevel.map()
+        mask = X.EnterWindowMask | X.LeaveWindowMask | X.PropertyChangeMask
         window.change_attributes(event_mask=mask)
+        window_property.cache.register(window)
         external_command.transset(window)
 
         return True
@@ -109,7 +135,7 @@ class VScreen(VScreenBase):
         '''Change the active window to WINDOW.  The active window is raised
         and activated.  The pointer is moved to the window.
         '''
-        window.raise_window()
+        window_geometry.toplevel(window).raise_window()
         self.pointer.move_to(window)
         self.activate_window(window)
 
@@ -119,7 +145,7 @@ class VScreen(VScreenBase):
 
         '''
         def _sort_key(window):
-            geom = window.get_geometry()
+            geom = window_geometry.get_geometry(window)
             return geom.x * 10000 + geom.y
 
         # fix integrity is only here
@@ -152,11 +178,160 @@ class VScreen(VScreenBase):
         self.select_window(window)
         return True
 
+    # ------------------------ state across restart
+    def dump_state(self):
+        '''Return the JSON-serializable state of the vscreen.'''
+        return {'windows': [window.id for window in self.managed_windows]}
+
+    def restore_state(self, state, windows):
+        '''Restore the state dumped by dump_state().  WINDOWS maps window id
+        to (window, attributes) of windows not yet managed; restored
+        windows are removed from WINDOWS.'''
+        for window_id in state.get('windows', []):
+            if window_id in windows:
+                self.manage_window(*windows.pop(window_id))
+
+    def find_managed_window(self, window_id):
+        for window in self.managed_windows:
+            if window.id == window_id:
+                return window
+        return None
+
+
+class WindowRegistry():
+    '''Map every managed window to the number of the vscreen managing it.
+    Also, index managed windows by their (lower-cased) window class with
+    the order of recently used.
+
+    '''
+
+    def __init__(self):
+        self.vscreen_numbers = {}
+        # class -> windows sorted by recently used
+        self.class_windows = {}
+        self.window_classes = {}
+        # window -> serial number of the last use, to compare windows
+        # of different classes
+        self.last_used = {}
+        self.serial = 0
+
+    def vscreen_number_of(self, window):
+        return self.vscreen_numbers.get(window, None)
+
+    def add(self, window, vscreen_number):
+        self.vscreen_numbers[window] = vscreen_number
+        if window in self.window_classes:
+            self.touch(window)
+        else:
+            self._index(window)
+
+    def remove(self, window, vscreen_number):
+        # the window might be already managed by another vscreen
+        if self.vscreen_numbers.get(window, None) == vscreen_number:
+            del self.vscreen_numbers[window]
+            self._unindex(window)
+
+    def touch(self, window):
+        '''Mark the window WINDOW as the most recently used of its class.'''
+        cls = self.window_classes.get(window, None)
+        if cls is not None:
+            self.class_windows[cls].move_to_end(window)
+            self._stamp(window)
+
+    def reindex(self, window):
+        '''Update the index after WM_CLASS of the window WINDOW changed.'''
+        if window in self.window_classes:
+            self._unindex(window)
+            self._index(window)
+
+    def find_class_window(self, window_class, vscreen_number=None):
+        '''Return the most recently used window whose class contains
+        WINDOW_CLASS, or None.  If VSCREEN_NUMBER is given, only windows on
+        the vscreen are looked up.'''
+        if window_class in self.class_windows:
+            classes = [window_class]
+        else:
+            classes = [cls for cls in self.class_windows if window_class in cls]
+        found = None
+        for cls in classes:
+            for window in reversed(self.class_windows[cls]):
+                if vscreen_number is None \
+                   or self.vscreen_numbers.get(window, None) == vscreen_number:
+                    if found is None or self.last_used[window] > self.last_used[found]:
+                        found = window
+                    break
+        return found
+
+    def _stamp(self, window):
+        self.serial += 1
+        self.last_used[window] = self.serial
+
+    def _index(self, window):
+        cls = window_property.get_window_class(window).lower()
+        self.window_classes[window] = cls
+        self.class_windows.setdefault(cls, collections.OrderedDict())[window] = None
+        self._stamp(window)
+
+    def _unindex(self, window):
+        self.last_used.pop(window, None)
+        cls = self.window_classes.pop(window, None)
+        windows = self.class_windows.get(cls, {})
+        windows.pop(window, None)
+        if not windows:
+            self.class_windows.pop(cls, None)
+
+
+class WindowList():
+    '''Windows sorted by recently focused on (the last is the most
+    recent).  Membership test, append, remove and move_to_end are O(1)
+    since the windows are kept in an OrderedDict.  Changes are reported
+    to the REGISTRY.
+
+    '''
+
+    def __init__(self, registry=None, vscreen_number=None):
+        self.windows = collections.OrderedDict()
+        self.registry = registry
+        self.vscreen_number = vscreen_number
+
+    def __contains__(self, window):
+        return window in self.windows
+
+    def __iter__(self):
+        return iter(list(self.windows))
+
+    def __reversed__(self):
+        return reversed(self.windows)
+
+    def __len__(self):
+        return len(self.windows)
+
+    def __getitem__(self, index):
+        try:
+            if index < 0:
+                return next(itertools.islice(reversed(self.windows), -index - 1, None))
+            return next(itertools.islice(self.windows, index, None))
+        except StopIteration:
+            raise IndexError('window list index out of range')
+
+    def append(self, window):
+        self.windows[window] = None
+        self.windows.move_to_end(window)
+        if self.registry is not None:
+            self.registry.add(window, self.vscreen_number)
+
+    def remove(self, window):
+        try:
+            del self.windows[window]
+        except KeyError:
+            raise ValueError('window not in window list')
+        if self.registry is not None:
+            self.registry.remove(window, self.vscreen_number)
 
-class WindowList(list):
-    def move_to_end(self, elem):
-        index = self.index(elem)
-        self.append(self.pop(index))
+    def move_to_end(self, window):
+        self.windows.move_to_end(window)
+        if self.registry is not None:
+            self.registry.touch(window)
 
     def sorted(self):
         '''Returns a sorted list. This method is used for *sorting*. The
@@ -170,12 +345,15 @@ class WindowList(list):
 
     def fix_integrity(self):
         '''Remove invalid window which can't be got geometry from managed
-        windows
+        windows.  Windows in the geometry model are known to be valid
+        because destroyed windows are removed from the model.
 
         '''
-        for window in self:
+        for window in list(self):
+            if window_geometry.model.is_known(window):
+                continue
             try:
-                window.get_geometry()
+                window_geometry.get_geometry(window)
             except (Xlib.error.BadWindow, Xlib.error.BadDrawable):
                 logging.error('remove %s from managed windows', window)
                 self.remove(window)
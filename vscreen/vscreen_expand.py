@@ -1,13 +1,15 @@
 #!/usr/bin/env python3
 
 import itertools
+import logging
 import re
 
 from Xlib import X
 
 from xpywm import configure
+from xpywm.vscreen import layout
 from xpywm.vscreen.vscreen import VScreen
-from xpywm.util import window_property
+from xpywm.util import window_geometry, window_property
 
 
 class VScreenExapndBase(VScreen):
@@ -39,8 +41,21 @@ class MaximizeWindow(VScreenExapndBase):
         '''Resize the geometry of the window WINDOW to cover the screen
         horizontally and/or vertically.'''
         _specify_window = window if output is None else None
-        window.configure(**xrandr.get_maximized_geometry(window=_specify_window,
-                                                         output=output))
+        window_geometry.configure(window, **xrandr.get_maximized_geometry(window=_specify_window,
+                                                                          output=output))
+
+    def dump_state(self):
+        state = super().dump_state()
+        state['unmaximized'] = {str(window.id): geom for window, geom
+                                in self.unmaximized_window_geometries.items()}
+        return state
+
+    def restore_state(self, state, windows):
+        super().restore_state(state, windows)
+        for window_id, geom in state.get('unmaximized', {}).items():
+            window = self.find_managed_window(int(window_id))
+            if window is not None:
+                self.unmaximized_window_geometries[window] = geom
 
     def _is_maximized(self, window, geom, xrandr):
         '''Check if the window WINDOW seems to have been maximized.'''
@@ -56,11 +71,11 @@ class MaximizeWindow(VScreenExapndBase):
     @window_property.return_with_get_geometry_exception
     @VScreenExapndBase.select_window_at_last
     def toggle_maximize_window(self, window):
-        geom = window.get_geometry()
+        geom = window_geometry.get_geometry(window)
         xrandr = self.displaysize.create_xrandr_request()
         unmaximized_geometry = self.unmaximized_window_geometries.get(window, None)
         if self._is_maximized(window, geom, xrandr) and unmaximized_geometry is not None:
-            window.configure(**unmaximized_geometry)
+            window_geometry.configure(window, **unmaximized_geometry)
             del self.unmaximized_window_geometries[window]
         else:
             self._save_window_geometry(window, geom)
@@ -76,14 +91,23 @@ class LayoutWindow(VScreenExapndBase):
                 geom = [*geom]
                 if re.search(regexp, window_property.get_window_class(window).lower(),
                              flags=re.IGNORECASE):
-                    window.configure(**xrandr.convert_geomtry(*geom))
+                    window_geometry.configure(window, **xrandr.convert_geomtry(*geom))
 
         xrandr = self.displaysize.create_xrandr_request()
-        for window in self.managed_windows:
-            layout_window(window, xrandr)
+        with window_geometry.batch():
+            for window in self.managed_windows:
+                layout_window(window, xrandr)
 
 
 class TileWindow(MaximizeWindow):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+        self.tile_layout = configure.TILE_LAYOUT
+        self.auto_tile = configure.AUTO_TILE
+        # managed windows in the order of the tile cells while auto-tiling
+        self.tile_slots = []
+
     def _window_sort_key(self, window):
         # force Emacs be the last, movie be the first in the
         # window list
@@ -94,48 +118,148 @@ class TileWindow(MaximizeWindow):
         else:
             return window.id
 
+    def _place_windows(self, windows, xrandr, output=None):
+        '''Place WINDOWS at the cells of the tiling layout in order.'''
+        if len(windows) == 1:
+            self.maximize_window(windows[0], xrandr, output=output)
+            return
+        geometries = layout.get_geometries(self.tile_layout, len(windows),
+                                           xrandr.get_usable_geometry(output))
+        for window, (x, y, width, height) in zip(windows, geometries):
+            window_geometry.configure(window, x=x, y=y, width=width, height=height)
+
     def _tile_windows(self, windows, xrandr, output=None):
-        windows = sorted(windows, key=self._window_sort_key)
-        ncols, nrows = configure.TILE_COUNTS[len(windows)]
-        for col, row in itertools.product(reversed(range(ncols)),
-                                          reversed(range(nrows))):
-            if not windows:
-                break
-            window = windows.pop(0)
-            x = 1 / ncols * col
-            y = 1 / nrows * row
-            width = 1 / ncols
-            height = 1 / nrows
-
-            if ncols == 1 and nrows == 1:
-                self.maximize_window(window, xrandr, output=output)
-                break
-            elif not windows:
-                # the last window is stretched to fill the remaining area
-                rest_height = 1 / nrows * row
-                y -= rest_height
-                height += rest_height
-            window.configure(**xrandr.convert_geomtry(x, y, width, height, output=output))
+        window_property.cache.prefetch_names(windows)
+        self._place_windows(sorted(windows, key=self._window_sort_key), xrandr, output=output)
+
+    def _output_groups(self, windows, xrandr):
+        '''Divide WINDOWS, in the order of the tile cells, among the outputs
+        as equally as possible.  Return the list of (windows, output).'''
+        if not xrandr.exist_expand_display:
+            return [(windows, None)]
+        groups = []
+        outputs = xrandr.outputs
+        rest = windows[::-1]
+        for i, output in enumerate(outputs):
+            count = (len(windows) + i) // len(outputs)
+            groups.append((rest[:count][::-1], output))
+            rest = rest[count:]
+        return groups
+
+    def _tile_outputs(self, windows, xrandr):
+        '''Tile WINDOWS, in the order of the tile cells, dividing them among
+        the outputs as equally as possible.'''
+        with window_geometry.batch():
+            for group, output in self._output_groups(windows, xrandr):
+                self._place_windows(group, xrandr, output=output)
+
+    def _tile_cells(self, windows, xrandr):
+        '''Return the dictionary of window -> cell (x, y, width, height) at
+        which _tile_outputs() places WINDOWS.'''
+        cells = {}
+        for group, output in self._output_groups(windows, xrandr):
+            if len(group) == 1:
+                cells[group[0]] = tuple(xrandr.get_maximized_geometry(output=output).values())
+            else:
+                cells.update(zip(group, layout.get_geometries(
+                    self.tile_layout, len(group), xrandr.get_usable_geometry(output))))
+        return cells
 
     @VScreenExapndBase.select_window_at_last
     def tile_all_windows(self, selected_window):
         '''NOTICE: selected_window argument is used in decorator'''
         xrandr = self.displaysize.create_xrandr_request()
-        if xrandr.exist_expand_display:
-            windows = sorted(self.managed_windows, key=self._window_sort_key,
-                             reverse=True)
-
-            outputs = xrandr.outputs
-            # divide as equally as possible
-            split_window_counts = ((len(windows) + i) // len(outputs)
-                                   for i in range(len(outputs)))
-
-            last_windows = windows
-            for output, window_count in zip(outputs, split_window_counts):
-                self._tile_windows(last_windows[:window_count], xrandr, output=output)
-                last_windows = last_windows[window_count:]
-        else:
-            self._tile_windows(self.managed_windows, xrandr)
+        window_property.cache.prefetch_names(self.managed_windows)
+        windows = sorted(self.managed_windows, key=self._window_sort_key)
+        if self.auto_tile:
+            self.tile_slots = windows
+        self._tile_outputs(windows, xrandr)
+
+    # ------------------------ auto-tiling
+    def toggle_auto_tile(self, window):
+        '''Toggle auto-tiling of the vscreen.  While auto-tiling, windows
+        are re-tiled whenever a window is mapped or unmapped.'''
+        self.auto_tile = not self.auto_tile
+        self.tile_slots = []
+        if self.auto_tile:
+            self.tile_all_windows(window)
+
+    def auto_tile_window(self, window):
+        '''Add the newly managed window WINDOW to the tile cells.  Existing
+        windows keep their order, and WINDOW is put at its position by
+        _window_sort_key(), the end or the beginning of the order,
+        whichever moves fewer windows on all outputs (the position by
+        _window_sort_key() on ties); only windows whose cell changes are
+        configured.  Transient and dialog windows are not tiled.'''
+        if not self.auto_tile or window in self.tile_slots or not self.is_managed(window):
+            return
+        if window_property.is_dialog_window(window):
+            return
+        xrandr = self.displaysize.create_xrandr_request()
+        slots = [other for other in self._current_slots() if other != window]
+        window_property.cache.prefetch_names(slots + [window])
+        key = self._window_sort_key(window)
+        sorted_index = next((i for i, other in enumerate(slots)
+                             if self._window_sort_key(other) > key), len(slots))
+        before = self._tile_cells(slots, xrandr)
+
+        def moved(index):
+            after = self._tile_cells(slots[:index] + [window] + slots[index:], xrandr)
+            return sum(after[other] != cell for other, cell in before.items())
+
+        # min() returns the first one on ties
+        slots.insert(min([sorted_index, len(slots), 0], key=moved), window)
+        self.tile_slots = slots
+        self._tile_outputs(slots, xrandr)
+
+    def auto_untile_window(self, window):
+        '''Remove the window WINDOW, which is no longer managed, from the
+        tile cells.'''
+        if not self.auto_tile or window not in self.tile_slots:
+            return
+        self.tile_slots = self._current_slots()
+        self._tile_outputs(self.tile_slots, self.displaysize.create_xrandr_request())
+        if self.current_focused_window is not None:
+            self.frame_window.draw_frame_windows(self.current_focused_window)
+
+    def _current_slots(self):
+        '''Return the tile order with unmanaged windows removed and windows
+        managed in other ways (e.g. moved from another vscreen), except
+        transient and dialog windows, added.'''
+        slots = [window for window in self.tile_slots if window in self.managed_windows]
+        known = set(slots)
+        slots.extend(window for window in self.managed_windows
+                     if window not in known and not window_property.is_dialog_window(window))
+        return slots
+
+    def set_tile_layout(self, name):
+        if name not in layout.LAYOUTS:
+            logging.error('unknown layout %s', name)
+            return
+        self.tile_layout = name
+
+    def cycle_tile_layout(self, window):
+        '''Switch the tiling layout of the vscreen to the next one in
+        TILE_LAYOUTS and tile all windows.'''
+        layouts = configure.TILE_LAYOUTS
+        i = layouts.index(self.tile_layout) if self.tile_layout in layouts else -1
+        self.set_tile_layout(layouts[(i + 1) % len(layouts)])
+        self.tile_all_windows(window)
+
+    def dump_state(self):
+        state = super().dump_state()
+        state['tile_layout'] = self.tile_layout
+        state['auto_tile'] = self.auto_tile
+        state['tile_slots'] = [window.id for window in self.tile_slots]
+        return state
+
+    def restore_state(self, state, windows):
+        super().restore_state(state, windows)
+        self.tile_layout = state.get('tile_layout', self.tile_layout)
+        self.auto_tile = state.get('auto_tile', self.auto_tile)
+        managed_windows = {window.id: window for window in self.managed_windows}
+        self.tile_slots = [managed_windows[window_id] for window_id in state.get('tile_slots', [])
+                           if window_id in managed_windows]
 
 
 class HorizontalSplitWindow(VScreenExapndBase):
@@ -150,13 +274,14 @@ class HorizontalSplitWindow(VScreenExapndBase):
         if self.last_index_hz >= len(hz_combinations):
             self.last_index_hz = 0
         windows = hz_combinations[self.last_index_hz]
-        self._tile_windows(windows=windows,
-                           xrandr=self.displaysize.create_xrandr_request())
+        with window_geometry.batch():
+            self._tile_windows(windows=windows,
+                               xrandr=self.displaysize.create_xrandr_request())
         # trick to use `select_last_window` between `windows`
         # move the current window to last of managed_windows
         self.managed_windows.move_to_end(windows[1])
         self.select_window(windows[0])
-        [window.raise_window() for window in windows]
+        [window_geometry.toplevel(window).raise_window() for window in windows]
 
 
 class PictureInPicture(VScreenExapndBase):
@@ -173,29 +298,49 @@ class PictureInPicture(VScreenExapndBase):
     # ------------------------
     def open(self):
         super().open()
-        if self.pip_window is not None:
-            self.pip_window.map()
+        # the pip window in the container is shown with the container
+        if self.pip_window is not None and self.container is None:
+            window_geometry.toplevel(self.pip_window).map()
 
     def close(self):
         super().close()
-        if self.pip_window is not None:
-            self.pip_window.unmap()
+        if self.pip_window is not None and self.container is None:
+            window_geometry.toplevel(self.pip_window).unmap()
 
     # ------------------------
-    def manage_window(self, window):
+    def manage_window(self, window, attrs=None):
         if window == self.pip_window:
             return
-        return super().manage_window(window)
+        return super().manage_window(window, attrs)
 
     def select_window(self, window):
         super().select_window(window)
         if self.pip_window is not None:
-            self.pip_window.configure(stack_mode=X.Above)
+            window_geometry.configure(self.pip_window, stack_mode=X.Above)
+
+    def dump_state(self):
+        state = super().dump_state()
+        if self.pip_window is not None:
+            state['pip'] = [self.pip_window.id, self.pip_window_geometry]
+        return state
+
+    def restore_state(self, state, windows):
+        super().restore_state(state, windows)
+        window_id, geom = state.get('pip', [None, None])
+        if window_id not in windows:
+            return
+        # set up the window as manage_pip_window() does, keeping its
+        # geometry
+        window, attrs = windows.pop(window_id)
+        if self.manage_window(window, attrs):
+            self.unmanage_window(window)
+            self.pip_window = window
+            self.pip_window_geometry = geom
 
     # ------------------------
     @window_property.return_with_get_geometry_exception
     def manage_pip_window(self, window):
-        geom = window.get_geometry()
+        geom = window_geometry.get_geometry(window)
 
         self.pip_window = window
         self.pip_window_geometry = {'x': geom.x, 'y': geom.y,
@@ -203,12 +348,13 @@ class PictureInPicture(VScreenExapndBase):
 
         self.unmanage_window(window)
         xrandr = self.displaysize.create_xrandr_request()
-        window.configure(**xrandr.convert_geomtry(px=(1 - PictureInPicture.PWIDTH),
-                                                  py=(1 - PictureInPicture.PHEIGHT),
-                                                  pwidth=PictureInPicture.PWIDTH,
-                                                  pheight=PictureInPicture.PHEIGHT,
-                                                  window=window),
-                         stack_mode=X.Above)
+        window_geometry.configure(window,
+                                  **xrandr.convert_geomtry(px=(1 - PictureInPicture.PWIDTH),
+                                                           py=(1 - PictureInPicture.PHEIGHT),
+                                                           pwidth=PictureInPicture.PWIDTH,
+                                                           pheight=PictureInPicture.PHEIGHT,
+                                                           window=window),
+                                  stack_mode=X.Above)
 
     def unmanage_pip_window(self):
         pip_window, pip_window_geometry = self.pip_window, self.pip_window_geometry
@@ -216,7 +362,7 @@ class PictureInPicture(VScreenExapndBase):
 
         success_manage_window = self.manage_window(pip_window)
         if success_manage_window:
-            pip_window.configure(**pip_window_geometry)
+            window_geometry.configure(pip_window, **pip_window_geometry)
             self.select_window(pip_window)
 
     def toggle_pip_window(self, window=None):
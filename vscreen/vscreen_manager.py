@@ -1,40 +1,90 @@
 #!/usr/bin/env python3
 
+from .vscreen import WindowRegistry
 from .vscreen_expand import VScreenExpand
 
 from xpywm import configure
+from xpywm.util import window_geometry
 
 
 class VScreenManager():
     '''Manage vscreen (virtual screeen). Also, move windows between
 vscreens.'''
 
-    def __init__(self, pointer, frame_window, displaysize):
+    def __init__(self, pointer, frame_window, displaysize, container_window=None):
         self.pointer = pointer
         self.frame_window = frame_window
+        self.displaysize = displaysize
+        self.container_window = container_window
 
+        self.registry = WindowRegistry()
         # create vscreens
-        self.vscreens = {i: VScreenExpand(displaysize, i, self.frame_window, self.pointer)
+        self.vscreens = {i: VScreenExpand(displaysize, i, self.frame_window, self.pointer,
+                                          self.registry, container_window)
                          for i in range(1, configure.MAX_VSCREEN + 1)}
 
         self.current_vscreen = self.vscreens[1]
         self.last_vscreen = self.vscreens[2]
+        if self.current_vscreen.container is not None:
+            self.current_vscreen.container.map()
 
     def is_vscreen_of(self, window):
-        for vscreen in self.vscreens.values():
-            if vscreen.is_managed(window):
-                return vscreen
-        return None
+        return self.vscreens.get(self.registry.vscreen_number_of(window), None)
 
     def exist(self, window):
         return self.is_vscreen_of(window)
 
+    def is_pip_window(self, window):
+        return any(vscreen.pip_window == window for vscreen in self.vscreens.values())
+
+    def client_window(self, window):
+        '''Return the client window for the window WINDOW, which is
+        event.child of an input event on the root window.'''
+        if self.container_window is not None:
+            window = self.container_window.client_at(window)
+        return self.frame_window.client_of(window)
+
     def find_managed_class_window(self, window_class):
+        return self.registry.find_class_window(window_class) or False
+
+    # ------------------------ state across restart
+    def dump_state(self):
+        '''Return the JSON-serializable state of all vscreens.'''
+        return {
+            'current': self.current_vscreen.vscreen_number,
+            'last': self.last_vscreen.vscreen_number,
+            'vscreens': {str(n): vscreen.dump_state() for n, vscreen in self.vscreens.items()},
+            'pointer': {str(window.id): geom for window, geom in self.pointer.geometries.items()},
+        }
+
+    @staticmethod
+    def state_window_ids(state):
+        '''Return the ids of windows in the state STATE.'''
+        ids = set()
+        for vscreen_state in state.get('vscreens', {}).values():
+            ids.update(vscreen_state.get('windows', []))
+            ids.add(vscreen_state.get('pip', [None])[0])
+        ids.discard(None)
+        return ids
+
+    def restore_state(self, state, windows):
+        '''Restore the state dumped by dump_state() in one pass.  WINDOWS
+        maps window id to (window, attributes) of windows not yet managed;
+        restored windows are removed from WINDOWS.'''
+        for n, vscreen in self.vscreens.items():
+            vscreen.restore_state(state.get('vscreens', {}).get(str(n), {}), windows)
+        managed_windows = {window.id: window for window in self.registry.vscreen_numbers}
+        for window_id, geom in state.get('pointer', {}).items():
+            if int(window_id) in managed_windows:
+                self.pointer.geometries[managed_windows[int(window_id)]] = geom
+
+        self.current_vscreen = self.vscreens.get(state.get('current'), self.vscreens[1])
+        self.last_vscreen = self.vscreens.get(state.get('last'), self.vscreens[2])
         for vscreen in self.vscreens.values():
-            window = vscreen.is_managed(window_class=window_class)
-            if window:
-                return window
-        return False
+            if vscreen is not self.current_vscreen:
+                vscreen.close()
+            elif vscreen.container is not None:
+                vscreen.container.map()
 
     # ------------------------
     def select_vscreen(self, n):
@@ -56,8 +106,14 @@ vscreens.'''
             return
         next_.manage_window(window)
         last.unmanage_window(window)
-        if last == self.current_vscreen:
-            window.unmap()
+        if last != self.current_vscreen:
+            return
+        if self.container_window is None:
+            window_geometry.toplevel(window).unmap()
+        else:
+            # the window is hidden with the container of NEXT_ without
+            # UnmapNotify, which clears the frame
+            self.frame_window.clear_frame_window(window)
 
     def toggle_window_vscreen(self, window):
         last = self.is_vscreen_of(window)
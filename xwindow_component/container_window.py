@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import collections
+
+import Xlib
+from Xlib import X
+
+from xpywm.util import window_geometry
+
+
+class ContainerWindow():
+    '''Root-sized windows, one for each vscreen, into which the client
+    windows of the vscreen are reparented (configure.VSCREEN_CONTAINERS).
+    Switching vscreens maps one container and unmaps another, whatever
+    the number of windows.
+
+    '''
+
+    EVENT_MASK = X.SubstructureRedirectMask | X.SubstructureNotifyMask
+
+    def __init__(self, display, screen):
+        self.display = display
+        self.screen = screen
+
+        # vscreen number -> container window
+        self.containers = {}
+        # window -> the number of UnmapNotify events caused by reparenting
+        self.pending_unmaps = collections.Counter()
+
+    # ------------------------
+    def create(self, vscreen_number):
+        '''Create the (unmapped) container of the vscreen VSCREEN_NUMBER.'''
+        geom = self.screen.root.get_geometry()
+        window = self.screen.root.create_window(
+            0,
+            0,
+            geom.width,
+            geom.height,
+            0,
+            self.screen.root_depth,
+            X.InputOutput,
+            background_pixmap=X.ParentRelative,
+            override_redirect=1,
+            event_mask=ContainerWindow.EVENT_MASK,
+        )
+        self.containers[vscreen_number] = window
+        return window
+
+    def is_container(self, window):
+        return window in self.containers.values()
+
+    def resize(self):
+        '''Resize all containers to the size of the root window.'''
+        geom = self.screen.root.get_geometry()
+        for window in self.containers.values():
+            window.configure(width=geom.width, height=geom.height)
+
+    # ------------------------
+    def adopt(self, window, container, mapped, save_set=True):
+        '''Reparent the window WINDOW, a client window or its frame, into
+        the container CONTAINER keeping its position.  MAPPED tells whether
+        WINDOW is mapped, for which the X server generates an UnmapNotify
+        event to be ignored.  With SAVE_SET, WINDOW is added to the
+        save-set, so that it is reparented back to the root window when
+        the window manager exits.'''
+        geom = window_geometry.get_geometry(window)
+        if mapped:
+            self.pending_unmaps[window] += 1
+        if save_set:
+            window.change_save_set(X.SetModeInsert)
+        window.reparent(container, geom.x, geom.y)
+
+    def release(self, window):
+        '''Reparent the window WINDOW, withdrawn by its client, back to the
+        root window.  The window may be already destroyed.'''
+        geom = window_geometry.model.geometries.get(window, None)
+        x, y = (geom.x, geom.y) if geom is not None else (0, 0)
+        catch = Xlib.error.CatchError(Xlib.error.BadWindow)
+        window.reparent(self.screen.root, x, y, onerror=catch)
+        window.change_save_set(X.SetModeDelete, onerror=catch)
+
+    def ignore_unmap(self, window):
+        '''Return True if the UnmapNotify event of the window WINDOW is not
+        caused by its client: caused by reparenting or of a container.'''
+        if self.pending_unmaps[window] > 0:
+            self.pending_unmaps[window] -= 1
+            return True
+        self.pending_unmaps.pop(window, None)
+        return self.is_container(window)
+
+    def forget(self, window):
+        self.pending_unmaps.pop(window, None)
+
+    # ------------------------
+    def client_at(self, window):
+        '''Return the client window under the pointer if the window WINDOW,
+        typically event.child of an input event on the root window, is a
+        container.'''
+        if not self.is_container(window):
+            return window
+        return window.query_pointer().child
@@ -3,8 +3,10 @@
 import logging
 
 import Xlib
+from Xlib.ext import randr
 
 from xpywm import configure
+from xpywm.util import window_geometry
 
 
 class DisplaySize():
@@ -12,36 +14,68 @@ class DisplaySize():
 
     # 1. create DisplaySize instance
     displaysize = DisplaySize()
-    # 2. create _XrandrRequest instance for each get timing
+    # 2. get the monitor layout for each get timing
     xrandr = displaysize.create_xrandr_request()
     # 3. request
     geom = xrandr.get_maximized_geometry()
 
+    The monitor layout is cached, and fetched again only after the X
+    server reports a change with RandR events (see invalidate()).
+
     '''
 
+    EVENT_MASK = (randr.RRScreenChangeNotifyMask | randr.RRCrtcChangeNotifyMask
+                  | randr.RROutputChangeNotifyMask)
+
     def __init__(self, display, screen):
         self.display = display
         self.screen = screen
 
-        self.primary_output = self.screen.root.xrandr_get_output_primary().output
-        self.last_crtcinfos = _XrandrRequest(self.display, self.screen,).crtcinfos
+        self.display.xrandr_query_version()
+        self.screen.root.xrandr_select_input(DisplaySize.EVENT_MASK)
+
+        self.layout = None
+        self.primary_output = None
+        self.last_crtcinfos = []
+        self.refresh_rate = None
+        self.create_xrandr_request()
+
+    def invalidate(self):
+        '''Discard the cached monitor layout.  Called on RandR events, which
+        come in a burst on hotplug, so nothing is fetched until the layout
+        is used next time.'''
+        logging.info('monitor layout changed')
+        self.layout = None
+
+    def get_refresh_rate(self):
+        '''Return the refresh rate [Hz] of the current monitor layout, or None
+        if it is unknown.'''
+        self.create_xrandr_request()
+        return self.refresh_rate
+
+    def _get_refresh_rate(self, resources):
+        '''Return the refresh rate [Hz] of the first active CRTC, or None if
+        it is unknown.  RESOURCES is the reply of
+        xrandr_get_screen_resources.'''
+        modes = {mode['id']: mode for mode in resources._data['modes']}
+        for crtcinfo in self.last_crtcinfos:
+            mode = modes.get(crtcinfo['mode'], None)
+            if mode and mode['h_total'] and mode['v_total']:
+                return mode['dot_clock'] / (mode['h_total'] * mode['v_total'])
+        return None
 
     def create_xrandr_request(self):
-        # This is because the xradnr_get_* will take some time.
-        logging.info('')
-        resources = self.screen.root.xrandr_get_screen_resources()
-        timestamp = resources.timestamp
-        # To reduce the number of xrandr_get_*, when the timestamp of
-        # the last information fetch is the same as the current
-        # timestamp, information is not newly fetched and use the last
-        # fetched information
-        crtcinfos = None
-        if timestamp == self.last_crtcinfos[0]['timestamp']:
-            crtcinfos = self.last_crtcinfos
-        xradnr_request = _XrandrRequest(self.display, self.screen,
-                                        resources, crtcinfos)
-        self.last_crtcinfos = xradnr_request.crtcinfos
-        return _Xrandr(self.primary_output, xradnr_request.connected_crtcinfos)
+        # This is because the xradnr_get_* will take some time.  The
+        # layout is fetched only when it has been invalidated.
+        if self.layout is None:
+            logging.info('fetch monitor layout')
+            self.primary_output = self.screen.root.xrandr_get_output_primary().output
+            xradnr_request = _XrandrRequest(self.display, self.screen)
+            self.last_crtcinfos = xradnr_request.crtcinfos
+            self.refresh_rate = self._get_refresh_rate(xradnr_request.resources) \
+                or self.refresh_rate
+            self.layout = _Xrandr(self.primary_output, xradnr_request.connected_crtcinfos)
+        return self.layout
 
 
 class _XrandrRequest():
@@ -51,9 +85,12 @@ class _XrandrRequest():
 
         # save crtcinfos for reuse it when the connection state changes
         if crtcinfos is None:
+            if resources is None:
+                resources = self.screen.root.xrandr_get_screen_resources()
             self.crtcinfos = self._get_crtcinfos(resources)
         else:
             self.crtcinfos = crtcinfos
+        self.resources = resources
         # Check the connection information every time because the
         # timestamp does not change even if the display connection is
         # changed
@@ -140,7 +177,7 @@ class _Xrandr():
 
     def _where_output_is_window(self, window):
         try:
-            x = window.get_geometry().x
+            x = window_geometry.get_geometry(window).x
         except (Xlib.error.BadWindow, Xlib.error.BadDrawable):
             # MEMO: no particular reason for this value
             x = 0
@@ -148,6 +185,9 @@ class _Xrandr():
             if crtcinfo['x'] <= x and x <= crtcinfo['x'] + crtcinfo['width']:
                 return output
 
+    def get_usable_geometry(self, output=None):
+        return self._get_usable_geometry(self._specify_output(output, None))
+
     def _get_usable_geometry(self, output):
         x, y, width, height = self.get_maximized_geometry(output).values()
         width -= configure.FRAME_WIDTH * 2
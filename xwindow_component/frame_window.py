@@ -1,75 +1,229 @@
 #!/usr/bin/env python3
 
+import collections
+import logging
+
+import Xlib
 from Xlib import X
+from Xlib.ext import shape
 
 from xpywm import configure
-from xpywm.util import window_property
+from xpywm.util import window_geometry, window_property
+
+SIDES = ['frame_l', 'frame_r', 'frame_u', 'frame_d']
+
+
+def frame_rectangles(geom, width=None):
+    '''Return the rectangles (x, y, width, height) of the four sides of
+    the frame surrounding the geometry GEOM.'''
+    if width is None:
+        width = configure.FRAME_WIDTH
+    return {
+        'frame_l': (geom.x - width, geom.y, width, geom.height),
+        'frame_r': (geom.x + geom.width, geom.y, width, geom.height),
+        'frame_u': (geom.x - width, geom.y - width, geom.width + 2 * width, width),
+        'frame_d': (geom.x - width, geom.y + geom.height, geom.width + 2 * width, width),
+    }
 
 
 class FrameWindow():
-    def __init__(self, screen):
+    '''Draw the frame surrounding the focused window.  With
+    configure.FRAME_MODE = 'strips', the frame consists of four windows.
+    With configure.FRAME_MODE = 'shape', the frame is a single window cut
+    to a border with the SHAPE extension.  With configure.FRAME_MODE =
+    'reparent', every managed window is reparented into its own frame
+    window, whose border color shows the focus.
+
+    '''
+
+    def __init__(self, display, screen):
+        self.display = display
         self.screen = screen
         self.frame_windows = {}
         self.framed_window = None
 
+        self.mode = configure.FRAME_MODE
+        if self.mode == 'shape' and not self.display.has_extension('SHAPE'):
+            logging.warning('SHAPE extension is not available')
+            self.mode = 'strips'
+        # (framed window, geometry) of the last drawn frame
+        self.last_drawn = None
+
+        # frame window -> client window in 'reparent' mode
+        self.clients = {}
+        # window -> the number of UnmapNotify events caused by reparenting
+        self.pending_unmaps = collections.Counter()
+        if self.mode == 'reparent':
+            colormap = self.screen.default_colormap
+            self.active_pixel = colormap.alloc_named_color(configure.FRAME_COLOR).pixel
+            self.inactive_pixel = colormap.alloc_named_color(
+                configure.FRAME_INACTIVE_COLOR).pixel
+
+    def _create_window(self, pixel):
+        return self.screen.root.create_window(
+            0,
+            0,
+            16,
+            16,
+            0,
+            self.screen.root_depth,
+            X.InputOutput,
+            background_pixel=pixel,
+            override_redirect=1,
+        )
+
     def create_frame_windows(self):
-        '''Create and map a window frame consisting of four windows.'''
+        '''Create and map a window frame consisting of four windows, or a
+        single shaped window.  No window is created in 'reparent' mode.'''
+        if self.mode == 'reparent':
+            return
         colormap = self.screen.default_colormap
-        # create four frame windows
         pixel = colormap.alloc_named_color(configure.FRAME_COLOR).pixel
-        for side in ['frame_l', 'frame_r', 'frame_u', 'frame_d']:
-            window = self.screen.root.create_window(
-                0,
-                0,
-                16,
-                16,
-                0,
-                self.screen.root_depth,
-                X.InputOutput,
-                background_pixel=pixel,
-                override_redirect=1,
-            )
+        sides = ['frame'] if self.mode == 'shape' else SIDES
+        for side in sides:
+            window = self._create_window(pixel)
             window.map()
             self.frame_windows[side] = window
 
     @window_property.return_with_get_geometry_exception
     def draw_frame_windows(self, framed_window):
-        '''Draw a frame window surrounding a windwow WINDOW.'''
-        geom = framed_window.get_geometry()
+        '''Draw a frame window surrounding a windwow WINDOW.  Only the frame
+        is raised if the window and its geometry are unchanged since the
+        last drawing.'''
+        if self.mode == 'reparent':
+            self._focus_frame(framed_window)
+            return
+        geom = window_geometry.get_geometry(framed_window)
         self.framed_window = framed_window
+        if self.last_drawn == (framed_window, geom):
+            # the window may have been raised above the frame since
+            for window in self.frame_windows.values():
+                window.configure(stack_mode=X.Above)
+            return
+        # NOTE: map only when the frame was cleared
+        need_map = self.last_drawn is None
+        self.last_drawn = framed_window, geom
 
-        for side in ['frame_l', 'frame_r', 'frame_u', 'frame_d']:
-            x, y, width, height = 0, 0, 0, 0
-            if side == 'frame_l':
-                x = geom.x - configure.FRAME_WIDTH
-                y = geom.y
-                width = configure.FRAME_WIDTH
-                height = geom.height
-            elif side == 'frame_r':
-                x = geom.x + geom.width
-                y = geom.y
-                width = configure.FRAME_WIDTH
-                height = geom.height
-            elif side == 'frame_u':
-                x = geom.x - configure.FRAME_WIDTH
-                y = geom.y - configure.FRAME_WIDTH
-                width = geom.width + 2 * configure.FRAME_WIDTH
-                height = configure.FRAME_WIDTH
-            elif side == 'frame_d':
-                x = geom.x - configure.FRAME_WIDTH
-                y = geom.y + geom.height
-                width = geom.width + 2 * configure.FRAME_WIDTH
-                height = configure.FRAME_WIDTH
-
+        if self.mode == 'shape':
+            self._draw_shaped_frame(geom, need_map)
+            return
+        for side, (x, y, width, height) in frame_rectangles(geom).items():
             window = self.frame_windows[side]
-            window.configure(x=x, y=y, width=width, height=height)
+            window.configure(x=x, y=y, width=width, height=height,
+                             stack_mode=X.Above)
+            if need_map:
+                window.map()
 
-            # NOTE: might be redundant
+    def _draw_shaped_frame(self, geom, need_map):
+        b = configure.FRAME_WIDTH
+        window = self.frame_windows['frame']
+        window.configure(x=geom.x - b, y=geom.y - b,
+                         width=geom.width + 2 * b, height=geom.height + 2 * b,
+                         stack_mode=X.Above)
+        # rectangles are relative to the frame window
+        rectangles = [(x - geom.x + b, y - geom.y + b, width, height)
+                      for x, y, width, height in frame_rectangles(geom).values()]
+        window.shape_rectangles(shape.SO.Set, shape.SK.Bounding, X.Unsorted,
+                                0, 0, rectangles)
+        if need_map:
             window.map()
-            window.raise_window()
 
     def clear_frame_window(self, window):
         if self.framed_window == window:
-            for side in ['frame_l', 'frame_r', 'frame_u', 'frame_d']:
-                win = self.frame_windows[side]
+            for win in self.frame_windows.values():
                 win.unmap()
+            self.last_drawn = None
+
+    # ------------------------ reparent mode
+    def attach(self, window, mapped):
+        '''Reparent the client window WINDOW into a new frame in 'reparent'
+        mode.  Return the window to be mapped, unmapped and restacked
+        instead of WINDOW: the frame of WINDOW, or WINDOW itself.  MAPPED
+        tells whether WINDOW is mapped, for which the X server generates an
+        UnmapNotify event to be ignored.'''
+        if self.mode != 'reparent':
+            return window
+        frame = window_geometry.toplevel(window)
+        if frame is not window:
+            return frame
+        geom = window_geometry.get_geometry(window)
+        b = configure.FRAME_WIDTH
+        frame = self.screen.root.create_window(
+            geom.x - b,
+            geom.y - b,
+            geom.width,
+            geom.height,
+            b,
+            self.screen.root_depth,
+            X.InputOutput,
+            border_pixel=self.inactive_pixel,
+            override_redirect=1,
+            event_mask=X.SubstructureRedirectMask | X.SubstructureNotifyMask,
+        )
+        # before add_frame(), which translates configures to the frame
+        window_geometry.configure(window, border_width=0)
+        window_geometry.model.add_frame(window, frame, window_geometry.Geometry(
+            geom.x - b, geom.y - b, geom.width, geom.height, b))
+        self.clients[frame] = window
+        if mapped:
+            self.pending_unmaps[window] += 1
+        window.change_save_set(X.SetModeInsert)
+        window.reparent(frame, 0, 0)
+        return frame
+
+    def release(self, window):
+        '''Reparent the window WINDOW, withdrawn by its client, out of its
+        frame to the root window and destroy the frame.  Return False if
+        WINDOW has no frame.'''
+        frame = window_geometry.toplevel(window)
+        if frame is window:
+            return False
+        geom = window_geometry.model.peek(window)
+        if geom is None:
+            try:
+                geom = window_geometry.get_geometry(window)
+            except (Xlib.error.BadWindow, Xlib.error.BadDrawable):
+                # already destroyed
+                pass
+        if geom is not None:
+            catch = Xlib.error.CatchError(Xlib.error.BadWindow)
+            window.reparent(self.screen.root, geom.x, geom.y, onerror=catch)
+            window.change_save_set(X.SetModeDelete, onerror=catch)
+        window_geometry.model.remove_frame(window)
+        self._destroy_frame(frame)
+        return True
+
+    def detach(self, window):
+        '''Destroy the frame of the destroyed window WINDOW.'''
+        frame = window_geometry.toplevel(window)
+        if frame is window:
+            return
+        window_geometry.model.remove_frame(window)
+        self._destroy_frame(frame)
+
+    def ignore_unmap(self, window):
+        '''Return True if the UnmapNotify event of the window WINDOW is not
+        caused by its client: caused by reparenting or of a frame.'''
+        if self.pending_unmaps[window] > 0:
+            self.pending_unmaps[window] -= 1
+            return True
+        self.pending_unmaps.pop(window, None)
+        return window in self.clients
+
+    def client_of(self, window):
+        '''Return the client window if the window WINDOW is a frame.'''
+        return self.clients.get(window, window)
+
+    def _destroy_frame(self, frame):
+        self.pending_unmaps.pop(self.clients.pop(frame, None), None)
+        frame.destroy()
+
+    def _focus_frame(self, window):
+        if window == self.framed_window:
+            return
+        for win, pixel in [(self.framed_window, self.inactive_pixel),
+                           (window, self.active_pixel)]:
+            frame = window_geometry.toplevel(win)
+            if frame is not win:
+                frame.change_attributes(border_pixel=pixel)
+        self.framed_window = window
@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 
+import logging
 import re
 
+from Xlib import X, Xatom
+from Xlib.ext import xinput
+
 from xpywm import configure
-from xpywm.util import external_command, window_property
+from xpywm.util import external_command, window_geometry, window_property
 
 
 class Pointer():
@@ -20,6 +24,26 @@ class Pointer():
         # is need to show cursor) -u1 [2019/10/28]
         self.last_show_request = None
         self.always_show_cursor = False
+        # same as last_show_request, for the touchpad
+        self.last_touchpad_request = None
+
+        # the version negotiation of XFixes and XInput is needed only
+        # once per connection
+        self.display.xfixes_query_version()
+        self.touchpads = self._find_touchpads()
+
+    def _find_touchpads(self):
+        '''Return the device ids of touchpads, or None if XInput2 is not
+        available.'''
+        if not self.display.has_extension(xinput.extname):
+            return None
+        self.display.xinput_query_version()
+        devices = self.display.xinput_query_device(xinput.AllDevices).devices
+        touchpads = [device.deviceid for device in devices
+                     if device.use in (xinput.SlavePointer, xinput.FloatingSlave)
+                     and re.search(configure.TOUCHPAD_REGEXP, device.name.lower())]
+        logging.info('touchpads %s', touchpads)
+        return touchpads
 
     @property
     def current_geometry(self):
@@ -45,7 +69,7 @@ class Pointer():
                 1: -1 * configure.POINTER_OFFSET,
             }.get(pval, 0)
 
-        geom = window.get_geometry()
+        geom = window_geometry.get_geometry(window)
         p_geom = self.geometries.get(window, configure.DEFAULT_POINTER_GEOMETRY)
         # MEMO: window.warp_pointer()
         self.move({
@@ -73,7 +97,7 @@ class Pointer():
         def is_bound(lower, value, upper):
             return lower <= value and value <= upper
 
-        geom = window.get_geometry()
+        geom = window_geometry.get_geometry(window)
         if geom_abs is None:
             return
         x_in_window, y_in_window = geom_abs['x'] - geom.x, geom_abs['y'] - geom.y
@@ -91,14 +115,26 @@ class Pointer():
         show = self.always_show_cursor or request
         if self.last_show_request == show:
             return
-        self.display.xfixes_query_version()
         if show:
             self.screen.root.xfixes_show_cursor()
         else:
             self.screen.root.xfixes_hide_cursor()
-        self.display.flush()
         self.last_show_request = show
 
+    def enable_touchpad(self, enable):
+        '''Enable or disable touchpads through the XInput2 "Device Enabled"
+        property.  Fall back to synclient if XInput2 is not available.'''
+        if self.last_touchpad_request == enable:
+            return
+        self.last_touchpad_request = enable
+        if self.touchpads is None:
+            external_command.enable_touchpad(enable)
+            return
+        atom = self.display.get_atom('Device Enabled')
+        for deviceid in self.touchpads:
+            self.display.xinput_change_device_property(deviceid, atom, Xatom.INTEGER,
+                                                       X.PropModeReplace, (8, [int(enable)]))
+
     def toggle_always_show_cursor(self):
         self.always_show_cursor = not self.always_show_cursor
         self.show_cursor(self.always_show_cursor)
@@ -106,5 +142,5 @@ class Pointer():
     def cursor_set(self, window):
         m = re.search(configure.STOP_CURSOR_CLS,
                       window_property.get_window_class(window).lower())
-        external_command.enable_touchpad(not m)
+        self.enable_touchpad(not m)
         self.show_cursor(not m)